@@ -0,0 +1,171 @@
+"""Lectura local de facturas electrónicas AFIP sin pasar por el asistente.
+
+Las facturas generadas por AFIP tienen siempre los mismos rótulos (Punto de Venta,
+Comp. Nro, Fecha de Emisión, CUIT, Importe Total...), así que con unas pocas
+expresiones regulares se puede completar el mismo JSON que devuelve el asistente.
+Solo se acepta el resultado si pasa las validaciones (dígito verificador del CUIT,
+fecha válida, total = neto + IVA + otros importes y que los renglones leídos sumen el
+neto); si no, se usa el asistente. Lo último importa porque un renglón con otro
+formato (sin unidad de medida, o con la descripción en dos líneas) no lo toma la
+expresión regular, y sin ese control la factura saldría con productos de menos.
+"""
+import re
+from datetime import datetime
+
+# Importes en formato argentino: 1.234,56 o 1234,56
+AMOUNT = r'(?:\d{1,3}(?:\.\d{3})+|\d+),\d{2}'
+
+FECHA_RE = re.compile(r'Fecha de Emisi[oó]n:\s*(\d{2}/\d{2}/\d{4})')
+# El PDF de AFIP a veces deja los rótulos juntos y los valores después. Un número sin
+# rótulo no se toma: puede ser un remito o una orden de compra, y dos facturas que citan
+# el mismo remito quedarían como duplicadas; esas van al asistente
+NUMERO_RES = [
+    re.compile(r'Punto de Venta:\s*(\d{1,5})\s*Comp\.?\s*Nro:?\s*(\d{1,8})'),
+    re.compile(r'Punto de Venta:\s*Comp\.?\s*Nro:?\s*(\d{1,5})\s+(\d{1,8})'),
+]
+CUIT_RE = re.compile(r'CUIT:\s*(\d{2}-?\d{8}-?\d)')
+CLIENTE_RE = re.compile(r'Apellido y Nombre\s*/\s*Raz[oó]n Social:\s*(.+)')
+TOTALS_START_RE = re.compile(r'Importe Neto Gravado:|Subtotal:|Importe Total:')
+NETO_RES = [
+    re.compile(r'Importe Neto Gravado:\s*\$?\s*(' + AMOUNT + ')'),
+    re.compile(r'Subtotal:\s*\$?\s*(' + AMOUNT + ')'),
+]
+IVA_RE = re.compile(r'IVA\s*\d+(?:[.,]\d+)?\s*%:\s*\$?\s*(' + AMOUNT + ')')
+OTROS_RES = [
+    re.compile(r'Importe Otros Tributos:\s*\$?\s*(' + AMOUNT + ')'),
+    re.compile(r'Importe Exento:\s*\$?\s*(' + AMOUNT + ')'),
+    re.compile(r'Importe Neto No Gravado:\s*\$?\s*(' + AMOUNT + ')'),
+]
+TOTAL_RE = re.compile(r'Importe Total:\s*\$?\s*(' + AMOUNT + ')')
+# Diferencia aceptada por renglón entre la suma de los productos y el neto (redondeos)
+ITEMS_TOLERANCE = 0.01
+ITEM_RE = re.compile(
+    r'^(?P<desc>\S.*?)\s+(?P<qty>' + AMOUNT + r')\s+(?P<unit>[^\d\s][^\d]*?)\s+'
+    r'(?P<price>' + AMOUNT + r')\s+(?P<rest>(?:(?:' + AMOUNT + r'|\d+(?:[.,]\d+)?%)\s*)+)$',
+    re.M,
+)
+
+CUIT_WEIGHTS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+def parse_amount(value):
+    """Convierte un importe en formato argentino ('1.234,56') a float."""
+    return float(value.replace('.', '').replace(',', '.'))
+
+def cuit_is_valid(cuit):
+    digits = re.sub(r'\D', '', cuit)
+    if len(digits) != 11:
+        return False
+    check = 11 - sum(int(d) * w for d, w in zip(digits, CUIT_WEIGHTS)) % 11
+    if check == 11:
+        check = 0
+    return check != 10 and check == int(digits[-1])
+
+def _first(patterns, text):
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match
+    return None
+
+def parse_afip_header(text):
+    """(CUIT emisor, número 'PPPPP-NNNNNNNN') leídos del texto, o None si falta alguno o el CUIT no valida."""
+    numero = _first(NUMERO_RES, text)
+    cuit = CUIT_RE.search(text)
+    if not numero or not cuit or not cuit_is_valid(cuit.group(1)):
+        return None
+    return re.sub(r'\D', '', cuit.group(1)), f'{int(numero.group(1)):05d}-{int(numero.group(2)):08d}'
+
+def check_items_total(subtotals, text):
+    """Error si los subtotales de los renglones no suman el neto de la factura (None si suman o no hay neto)."""
+    neto = _first(NETO_RES, text)
+    if not neto or not subtotals:
+        return None
+    items_total = sum(subtotals)
+    neto_value = parse_amount(neto.group(1))
+    # Los renglones exentos o no gravados no entran en el neto gravado
+    otros_netos = sum(parse_amount(m.group(1)) for p in OTROS_RES[1:] for m in p.finditer(text))
+    tolerance = max(0.05, ITEMS_TOLERANCE * len(subtotals))
+    if any(abs(items_total - expected) <= tolerance for expected in (neto_value, neto_value + otros_netos)):
+        return None
+    return f'los productos leídos suman {items_total:.2f} y el neto es {neto.group(1)} (puede faltar algún renglón)'
+
+def _parse_items(text):
+    # Los renglones de productos están antes del bloque de totales
+    end = TOTALS_START_RE.search(text)
+    items = []
+    for match in ITEM_RE.finditer(text[:end.start()] if end else text):
+        rest = match.group('rest').split()
+        # Factura A: ... Subtotal Alícuota% Subtotal c/IVA; factura B/C: el subtotal es el último
+        subtotal = rest[-1]
+        for i, token in enumerate(rest[1:], start=1):
+            if token.endswith('%'):
+                subtotal = rest[i - 1]
+                break
+        items.append({
+            'Descripción': match.group('desc').strip(),
+            'Cantidad': match.group('qty'),
+            'Precio Unitario': match.group('price'),
+            'Subtotal': subtotal,
+        })
+    return items
+
+def parse_afip_invoice(text):
+    """Devuelve (invoice_dict, errores). invoice_dict es None si falta algo o no valida."""
+    errors = []
+    if not text:
+        return None, ['texto vacío']
+
+    fecha = FECHA_RE.search(text)
+    if not fecha:
+        errors.append('falta Fecha')
+    else:
+        try:
+            datetime.strptime(fecha.group(1), '%d/%m/%Y')
+        except ValueError:
+            errors.append(f'fecha inválida: {fecha.group(1)}')
+
+    numero = _first(NUMERO_RES, text)
+    if not numero:
+        errors.append('falta Número de Factura')
+
+    cuit = CUIT_RE.search(text)
+    if not cuit:
+        errors.append('falta CUIT Emisor')
+    elif not cuit_is_valid(cuit.group(1)):
+        errors.append(f'CUIT con dígito verificador inválido: {cuit.group(1)}')
+
+    total = TOTAL_RE.search(text)
+    neto = _first(NETO_RES, text)
+    if not total:
+        errors.append('falta Importe Total')
+    if not neto:
+        errors.append('falta Importe Neto/Subtotal')
+    iva = sum(parse_amount(m.group(1)) for m in IVA_RE.finditer(text))
+    if total and neto:
+        otros = sum(parse_amount(m.group(1)) for p in OTROS_RES for m in p.finditer(text))
+        expected = parse_amount(neto.group(1)) + iva + otros
+        if abs(expected - parse_amount(total.group(1))) > 0.05:
+            errors.append(f'el total {total.group(1)} no coincide con neto + IVA + otros ({expected:.2f})')
+
+    items = _parse_items(text)
+    if not items:
+        errors.append('no se encontró el detalle de productos')
+    else:
+        items_error = check_items_total([parse_amount(item['Subtotal']) for item in items], text)
+        if items_error:
+            errors.append(items_error)
+
+    if errors:
+        return None, errors
+
+    cliente = CLIENTE_RE.search(text)
+    invoice = {
+        'Fecha': fecha.group(1),
+        'Número de Factura': f'{int(numero.group(1)):05d}-{int(numero.group(2)):08d}',
+        'CUIT Emisor': re.sub(r'\D', '', cuit.group(1)),
+        'Cliente': cliente.group(1).strip() if cliente else '',
+        'Importe Total': total.group(1),
+        'IVA': f'{iva:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.'),
+        'Detalle de Productos': items,
+    }
+    return invoice, []
@@ -1,141 +1,126 @@
 import streamlit as st
-from openai import OpenAI
-from openai import AssistantEventHandler
-from typing_extensions import override
 import os
-import re
-import pandas as pd
-import PyPDF2
-import io
-from io import BytesIO
-import json
+from invoice_cache import InvoiceCache
+from invoice_index import InvoiceIndex
+from faq_cache import FAQCache
+from job_queue import JobQueue
+from worker import start_workers
+from export import IncrementalExporter, invoice_to_products
+from product_store import ProductStore
+from pdf_text import SLOW_PAGE_SECONDS
+import metrics
+from assistant_backend import (ASSISTANT_ID, BACKENDS, DEFAULT_BACKEND, ChatSession, cache_version, make_client,
+                               stream_chat_reply)
 try:
   from tokens import openai_key
 except ImportError:
   openai_key = os.getenv('OPENAI_API_KEY')
 
-class EventHandler(AssistantEventHandler):
-    @override    
-    def on_text_created(self, text) -> None:
-        print(f"\nassistant > ", end="", flush=True)
-    @override     
-    def on_text_delta(self, delta, snapshot):
-        print(delta.value, end="", flush=True)
-        
-def on_tool_call_created(self, tool_call):
-  print(f"\nassistant > {tool_call.type}\n", flush=True)
-
-def on_tool_call_delta(self, delta, snapshot):
-  if delta.type == 'code_interpreter':
-    if delta.code_interpreter.input:
-      print(delta.code_interpreter.input, end="", flush=True)
-    if delta.code_interpreter.outputs:
-      print(f"\n\noutput >", flush=True)
-      for output in delta.code_interpreter.outputs:
-        if output.type == "logs":
-          print(f"\n{output.logs}", flush=True)
-
-def extract_text_from_pdf(pdf_file):
-    reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() or ""
-    return text
-
-def extract_and_fix_json(text):
-    """Extract JSON from text and fix common formatting issues."""
-    # Try to find JSON pattern in the text
-    json_match = re.search(r'\{.*\}', text, re.DOTALL)
-    
-    if not json_match:
-        return None
-    
-    json_str = json_match.group()
-    
-    # Fix common JSON formatting issues
-    # 1. Fix single quotes to double quotes
-    json_str = re.sub(r"(?<!\\')'([^']*)'(?!\\')", r'"\1"', json_str)
-    
-    # 2. Ensure property names have double quotes
-    json_str = re.sub(r'(\s*)([a-zA-Z0-9_]+)(\s*):(\s*)', r'\1"\2"\3:\4', json_str)
-    
-    # 3. Replace trailing commas before closing brackets
-    json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
-    
-    try:
-        # Attempt to parse the JSON
-        json_obj = json.loads(json_str)
-        return json_obj
-    except json.JSONDecodeError as e:
-        st.warning(f"Error al parsear JSON: {e}. Intentando método alternativo...")
-        
-        # If standard parsing fails, try a more aggressive approach
-        try:
-            # Use a third-party JSON parser that's more forgiving (simulating with manual fixes)
-            # Replace single quotes with double quotes (but not escaped ones)
-            json_str = json_str.replace("'", '"').replace('\\"', "'")
-            
-            # Fix missing quotes around property names
-            json_str = re.sub(r'([{,]\s*)([a-zA-Z0-9_]+)(\s*:)', r'\1"\2"\3', json_str)
-            
-            return json.loads(json_str)
-        except Exception:
-            return None
-
-def process_invoice_with_ai(client, pdf_text):
-    thread = client.beta.threads.create()
-    message = client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=f"""Extraé la siguiente información de esta factura en formato JSON válido: 
-        {{
-        "Fecha": "...", 
-        "Número de Factura": "...", 
-        "CUIT Emisor": "...", 
-        "Cliente": "...", 
-        "Importe Total": "...", 
-        "IVA": "...", 
-        "Detalle de Productos": [
-            {{"Descripción": "...", "Cantidad": "...", "Precio Unitario": "...", "Subtotal": "..."}}
-        ]
-        }}
-        
-        Es muy importante que:
-        1. El formato sea JSON válido con comillas dobles para las claves
-        2. 'Detalle de Productos' sea un array de objetos con la información de cada producto
-        3. No agregues comentarios ni texto adicional en la respuesta, solo el JSON
-        
-        El texto de la factura es: 
-        {pdf_text}"""
-    )
-    
-    with client.beta.threads.runs.stream(
-        thread_id=thread.id,
-        assistant_id='asst_nnDTLYK0nrjuIBJCdscnA6vb',
-        event_handler=EventHandler()) as stream:
-            stream.until_done()
-            bot_response = stream.get_final_messages()
-            bot_reply = bot_response[0].content[0].text.value
-            bot_reply = re.sub(r"【.*?】", "", bot_reply)
-    
-    return bot_reply
+# Filas que se muestran en pantalla al exportar
+PREVIEW_ROWS = 1000
+# Workers que levanta la app si no hay workers externos (ver worker.py)
+LOCAL_WORKERS = int(os.getenv('DASSA_LOCAL_WORKERS', '2'))
+# Mensajes del historial que se dibujan en cada rerun; los anteriores quedan detrás de un toggle
+HISTORY_RENDER = 30
+
+# Las imágenes se leen del disco una sola vez
+@st.cache_data
+def load_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+AVATAR = load_image('avatar.png')
 
 # Configuración inicial
 col_title, col_logo = st.columns([5, 1])
 with col_title:
   st.title("DASSA Bot - Procesador de Facturas")
 with col_logo:
-  st.image('logo.png')
+  st.image(load_image('logo.png'))
+
+# Un solo cliente (y su pool de conexiones) para todas las sesiones y reruns.
+# Se crea recién con el primer mensaje de chat: las facturas las procesan los workers
+@st.cache_resource
+def get_client():
+    return make_client(openai_key)
+invoice_backend = st.sidebar.selectbox("Modo de extracción", BACKENDS, index=BACKENDS.index(DEFAULT_BACKEND),
+                                       help="structured: una sola llamada con JSON schema. threads: asistente original.")
+
+@st.cache_resource
+def get_invoice_cache():
+    return InvoiceCache()
 
-client = OpenAI(
-    api_key=openai_key)
+invoice_cache = get_invoice_cache()
+cache_stats = invoice_cache.stats()
+st.sidebar.caption(f"Caché de facturas: {cache_stats['entries']} guardadas · {cache_stats['hits']} aciertos · {cache_stats['misses']} fallos")
+
+# Facturas ya procesadas (por cualquier operador), para no exportarlas dos veces
+@st.cache_resource
+def get_invoice_index():
+    return InvoiceIndex()
+
+invoice_index = get_invoice_index()
+st.sidebar.caption(f"Facturas duplicadas evitadas: {invoice_index.stats()['duplicates']}")
+with st.sidebar.expander("Volver a procesar una factura"):
+    st.caption("La saca del registro de facturas procesadas; después se puede subir de nuevo.")
+    forget_cuit = st.text_input("CUIT del emisor", key="forget_cuit")
+    forget_number = st.text_input("Número de factura", key="forget_number")
+    if st.button("Olvidar factura", disabled=not (forget_cuit and forget_number)):
+        if invoice_index.forget(forget_cuit, forget_number):
+            st.success(f"La factura {forget_number} ya se puede volver a procesar.")
+        else:
+            st.warning(f"No hay ninguna factura {forget_number} de CUIT {forget_cuit} registrada.")
+
+# Respuestas del chat a preguntas frecuentes, compartidas entre sesiones
+@st.cache_resource
+def get_faq_cache():
+    return FAQCache(version=ASSISTANT_ID)
+
+faq_cache = get_faq_cache()
+faq_stats = faq_cache.stats()
+st.sidebar.caption(f"Preguntas frecuentes: {faq_stats['entries']} guardadas · {faq_stats['exact'] + faq_stats['similar']} respondidas sin API")
+if st.sidebar.button("Borrar respuestas guardadas", disabled=not faq_stats['entries']):
+    faq_cache.invalidate()
+    st.rerun()
+
+# Las facturas se procesan en workers aparte; la app solo encola y consulta el estado
+@st.cache_resource
+def get_job_queue():
+    if not os.getenv('DASSA_EXTERNAL_WORKERS'):
+        start_workers(LOCAL_WORKERS)
+    return JobQueue()
+
+job_queue = get_job_queue()
+queue_counts = job_queue.counts()
+st.sidebar.caption(f"Cola: {queue_counts.get('queued', 0)} en espera · {queue_counts.get('running', 0)} procesando")
+
+# Panel de administración: tiempos por etapa y consumo de tokens
+if st.sidebar.toggle("Ver métricas"):
+    with st.sidebar:
+        records = metrics.load()
+        stages, usage = metrics.summarize(records)
+        st.dataframe(
+            [{"Etapa": stage, "N": s["count"], "Errores": s["errors"], "p50 (s)": round(s["p50"], 3), "p95 (s)": round(s["p95"], 3)}
+             for stage, s in sorted(stages.items())],
+            hide_index=True
+        )
+        for model, u in usage.items():
+            st.caption(f"{model}: {u['requests']} requests · {u['prompt_tokens'] + u['completion_tokens']} tokens · US$ {u['cost_usd']:.4f}")
+        fallbacks = sum(1 for r in records if r.get('stage') == 'json_parse' and r.get('path') == 'lenient')
+        st.caption(f"JSON reparado por el parser tolerante: {fallbacks} veces")
+        slow_pages = sum(1 for r in records if r.get('type') == 'slow_page')
+        st.caption(f"Páginas de PDF lentas (más de {SLOW_PAGE_SECONDS:.0f} s): {slow_pages}")
+        with st.expander("Formato Prometheus"):
+            st.code(metrics.prometheus_text(records), language="text")
 
 # Inicializar variables de sesión
-if 'processed_invoices' not in st.session_state:
-    st.session_state.processed_invoices = []
-    
-if 'processed_products' not in st.session_state:
-    st.session_state.processed_products = []
+# Facturas y productos en tablas por columnas (el encabezado no se repite en cada producto)
+if 'product_store' not in st.session_state:
+    st.session_state.product_store = ProductStore()
+
+# Las filas se van escribiendo al Excel/CSV a medida que se procesan las facturas
+if 'exporter' not in st.session_state:
+    st.session_state.exporter = IncrementalExporter()
 
 if 'conversation_started' not in st.session_state:
     st.session_state.conversation_started = True  # Set to True by default to show upload option immediately
@@ -146,156 +131,176 @@ if 'asking_for_more' not in st.session_state:
 if 'finished' not in st.session_state:
     st.session_state.finished = False
 
+# El chat reutiliza el mismo thread durante toda la sesión
+if 'chat_session' not in st.session_state:
+    st.session_state.chat_session = ChatSession()
+
+# Trabajos encolados que todavía no terminaron
+if 'pending_jobs' not in st.session_state:
+    st.session_state.pending_jobs = []
+    st.session_state.jobs_total = 0
+    st.session_state.batch_start = 0
+    st.session_state.upload_round = 0
+    st.session_state.finished_jobs = []
+
 # Mostrar mensajes de chat anteriores
 if 'messages' not in st.session_state:
     st.session_state.messages = [
         {"role": "assistant", "content": "¡Hola! Soy DASSA-Bot. Sube una factura en PDF para procesarla. 🤖", "avatar": "avatar.png"}
     ]
 
-for message in st.session_state.messages:
-    st.chat_message(message["role"], avatar=message.get("avatar")).write(message["content"])
+def show_message(message):
+    avatar = message.get("avatar")
+    st.chat_message(message["role"], avatar=load_image(avatar) if avatar else None).write(message["content"])
+
+@st.fragment
+def show_older_messages(messages):
+    # El toggle vuelve a correr solo este fragmento, no la app entera
+    if st.toggle(f"Ver {len(messages)} mensajes anteriores"):
+        for message in messages:
+            show_message(message)
+
+older = st.session_state.messages[:-HISTORY_RENDER]
+if older:
+    show_older_messages(older)
+for message in st.session_state.messages[-HISTORY_RENDER:]:
+    show_message(message)
+
+def products_frame(since_invoice=0, last=None):
+    """DataFrame de productos; se vuelve a armar solo si llegaron facturas nuevas.
+
+    Al reiniciar la sesión con un ProductStore nuevo hay que sacar 'products_frame'.
+    """
+    store = st.session_state.product_store
+    key = (store.invoice_count, since_invoice, last)
+    cached = st.session_state.get('products_frame')
+    if cached is None or cached[0] != key:
+        with metrics.span('dataframe_build'):
+            cached = (key, store.to_frame(since_invoice=since_invoice, last=last))
+        st.session_state.products_frame = cached
+    return cached[1]
 
 # Entrada del usuario
 user_input = st.chat_input("Ingresa tu mensaje...")
 
+def record_invoice(name, invoice_dict, note=""):
+    products = invoice_to_products(invoice_dict)
+    st.session_state.product_store.add_invoice(invoice_dict)
+    st.session_state.exporter.append(products)
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": f"He analizado la factura {name}{note}: {len(products)} productos.",
+        "avatar": "avatar.png"
+    })
+
+def record_duplicate(name, detail):
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": f"La factura {name} ya había sido procesada ({detail}). No la agrego de nuevo a la exportación. "
+                   "Si hay que procesarla igual, usá «Volver a procesar una factura» en la barra lateral.",
+        "avatar": "avatar.png"
+    })
+
+def record_job(job):
+    if job.status == 'duplicate':
+        record_duplicate(job.name, job.error)
+    elif job.status == 'error':
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": f"Ocurrió un error al procesar la factura {job.name}: {job.error}",
+            "avatar": "avatar.png"
+        })
+    elif job.invoice_dict:
+        # Con invoice_dict, el error es el aviso de que los renglones no suman el neto
+        record_invoice(job.name, job.invoice_dict, f" (revisar: {job.error})" if job.error else "")
+    else:
+        # Si no se puede extraer JSON válido
+        record_unstructured(job.name, job.error, job.reply)
+
+def record_unstructured(name, error, reply):
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": f"He analizado la factura {name} pero no pude estructurar la información correctamente ({error}).\n\n{reply}",
+        "avatar": "avatar.png"
+    })
+
+@st.fragment(run_every=1.0)
+def show_pending_jobs():
+    """Consulta la cola sin rerun completo; la app se redibuja entera recién cuando termina el lote."""
+    jobs = job_queue.get(st.session_state.pending_jobs)
+    st.session_state.pending_jobs = [job.id for job in jobs if not job.done]
+    for job in jobs:
+        if job.done:
+            # pending_jobs ya no tiene este trabajo: si algo falla acá hay que avisarlo, no perderlo
+            try:
+                record_job(job)
+                outcome = job.status if job.status == 'duplicate' else ('ok' if job.invoice_dict else 'error')
+            except Exception as e:
+                record_unstructured(job.name, f"{type(e).__name__}: {e}", job.reply)
+                outcome = 'error'
+            st.session_state.finished_jobs.append((job.name, outcome))
+    if not st.session_state.pending_jobs:
+        st.session_state.jobs_total = 0
+        st.session_state.finished_jobs = []
+        st.rerun()
+
+    total = st.session_state.jobs_total
+    done = total - len(st.session_state.pending_jobs)
+    st.progress(done / total if total else 0.0, text=f"Procesadas {done} de {total} facturas")
+    labels = {'ok': "✅ {}: lista", 'error': "⚠️ {}: con errores", 'duplicate': "🔁 {}: ya procesada antes"}
+    for name, outcome in st.session_state.finished_jobs:
+        st.write(labels[outcome].format(name))
+    for job in jobs:
+        if job.done:
+            continue
+        if job.status == 'queued':
+            st.write(f"⏳ {job.name}: en cola")
+        else:
+            st.write(f"🤖 {job.name}: procesando" + (f" (intento {job.attempts})" if job.attempts > 1 else ""))
+
 # Subida de archivos - Mostrar siempre la opción de subir archivo si no estamos en estado de asking_for_more o finished
 if not st.session_state.asking_for_more and not st.session_state.finished:
-    pdf_file = st.file_uploader("Sube una factura en PDF", type=["pdf"], key=f"pdf_uploader_{len(st.session_state.processed_invoices)}")
+    batch_mode = st.toggle("Modo lote (varias facturas a la vez)", key="batch_mode")
+    uploader_key = f"pdf_uploader_{st.session_state.upload_round}"
+    if batch_mode:
+        pdf_files = st.file_uploader("Sube las facturas en PDF", type=["pdf"], accept_multiple_files=True, key=uploader_key)
+        if not (pdf_files and st.button(f"Procesar {len(pdf_files)} facturas")):
+            pdf_files = []
+    else:
+        pdf_file = st.file_uploader("Sube una factura en PDF", type=["pdf"], key=uploader_key)
+        pdf_files = [pdf_file] if pdf_file is not None else []
     
-    if pdf_file is not None:
-        with st.spinner("Procesando factura..."):
-            # Extraer texto del PDF
-            pdf_text = extract_text_from_pdf(pdf_file)
-            
-            # Procesar la factura con OpenAI
-            invoice_data_json = process_invoice_with_ai(client, pdf_text)
-            
-            # Parsear los datos JSON
-            try:
-                # Usar nuestra función mejorada de extracción de JSON
-                invoice_dict = extract_and_fix_json(invoice_data_json)
-                
-                if invoice_dict:
-                    # Extraer productos y agregar información del encabezado a cada producto
-                    products = []
-                    if 'Detalle de Productos' in invoice_dict and isinstance(invoice_dict['Detalle de Productos'], list):
-                        for product in invoice_dict['Detalle de Productos']:
-                            # Añadir información del encabezado a cada producto
-                            product_with_header = {
-                                'Fecha': invoice_dict.get('Fecha', ''),
-                                'Número de Factura': invoice_dict.get('Número de Factura', ''),
-                                'CUIT Emisor': invoice_dict.get('CUIT Emisor', ''),
-                                'Cliente': invoice_dict.get('Cliente', ''),
-                                'Importe Total Factura': invoice_dict.get('Importe Total', ''),
-                                'IVA': invoice_dict.get('IVA', ''),
-                            }
-                            # Añadir detalles del producto
-                            product_with_header.update(product)
-                            products.append(product_with_header)
-                    
-                    # Si no hay productos específicos, crear una fila con la información general
-                    if not products:
-                        products = [{
-                            'Fecha': invoice_dict.get('Fecha', ''),
-                            'Número de Factura': invoice_dict.get('Número de Factura', ''),
-                            'CUIT Emisor': invoice_dict.get('CUIT Emisor', ''),
-                            'Cliente': invoice_dict.get('Cliente', ''),
-                            'Importe Total Factura': invoice_dict.get('Importe Total', ''),
-                            'IVA': invoice_dict.get('IVA', ''),
-                            'Descripción': 'Información general',
-                            'Subtotal': invoice_dict.get('Importe Total', '')
-                        }]
-                    
-                    # Guardar productos en session state
-                    st.session_state.processed_products.extend(products)
-                    
-                    # Guardar factura completa
-                    st.session_state.processed_invoices.append(invoice_dict)
-                    
-                    # Crear DataFrame para mostrar en pantalla
-                    df_products = pd.DataFrame(products)
-                    
-                    # Mostrar tabla de productos
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": f"He analizado la factura. Aquí está la información de los productos:", 
-                        "avatar": "avatar.png"
-                    })
-                    st.chat_message("assistant", avatar="avatar.png").write("He analizado la factura. Aquí está la información de los productos:")
-                    
-                    # Mostrar el DataFrame
-                    st.dataframe(df_products)
-                    
-                    # Crear botones para continuar o finalizar
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        if st.button("Agregar otra factura"):
-                            st.session_state.messages.append({
-                                "role": "assistant", 
-                                "content": "Puedes subir otra factura.", 
-                                "avatar": "avatar.png"
-                            })
-                            st.experimental_rerun()
-                    
-                    with col2:
-                        if st.button("Finalizar y exportar"):
-                            st.session_state.finished = True
-                            st.experimental_rerun()
+    if pdf_files:
+        if not st.session_state.pending_jobs:
+            st.session_state.batch_start = st.session_state.product_store.invoice_count
+        for pdf_file in pdf_files:
+            data = pdf_file.getvalue()
+            cache_key = InvoiceCache.make_key(data, cache_version(invoice_backend))
+            # Si ya procesamos este mismo PDF, usar el resultado guardado
+            cached = invoice_cache.get(cache_key)
+            if cached:
+                original = invoice_index.register(cached.invoice_dict, cached.pdf_text, pdf_file.name)
+                if original:
+                    record_duplicate(pdf_file.name, original.describe())
                 else:
-                    # Si no se puede extraer JSON válido
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": f"He analizado la factura pero no pude estructurar la información correctamente.\n\n{invoice_data_json}", 
-                        "avatar": "avatar.png"
-                    })
-                    st.chat_message("assistant", avatar="avatar.png").write(f"He analizado la factura pero no pude estructurar la información correctamente.\n\n{invoice_data_json}")
-                    st.session_state.processed_invoices.append({"Datos": invoice_data_json})
-                    
-                    # Crear botones para continuar o finalizar
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        if st.button("Agregar otra factura"):
-                            st.session_state.messages.append({
-                                "role": "assistant", 
-                                "content": "Puedes subir otra factura.", 
-                                "avatar": "avatar.png"
-                            })
-                            st.experimental_rerun()
-                    
-                    with col2:
-                        if st.button("Finalizar y exportar"):
-                            st.session_state.finished = True
-                            st.experimental_rerun()
-            except Exception as e:
-                st.warning(f"No se pudo extraer JSON estructurado: {e}")
-                # Mostrar el texto original para depuración
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": f"Ocurrió un error al procesar la factura: {str(e)}\n\nRespuesta original: {invoice_data_json[:500]}...",
-                    "avatar": "avatar.png"
-                })
-                st.chat_message("assistant", avatar="avatar.png").write(f"Ocurrió un error al procesar la factura: {str(e)}")
-                st.code(invoice_data_json, language="json")  # Mostrar como código para mejor visualización
-                st.session_state.processed_invoices.append({"Datos": invoice_data_json})
-                
-                # Crear botones para continuar o finalizar
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    if st.button("Agregar otra factura"):
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": "Puedes subir otra factura.", 
-                            "avatar": "avatar.png"
-                        })
-                        st.experimental_rerun()
-                
-                with col2:
-                    if st.button("Finalizar y exportar"):
-                        st.session_state.finished = True
-                        st.experimental_rerun()
+                    record_invoice(pdf_file.name, cached.invoice_dict, " (desde caché)")
+            else:
+                st.session_state.pending_jobs.append(job_queue.enqueue(pdf_file.name, data, invoice_backend, cache_key))
+                st.session_state.jobs_total += 1
+        # Nuevo uploader vacío, así un rerun no vuelve a encolar los mismos archivos
+        st.session_state.upload_round += 1
+        st.rerun()
+    
+    if st.session_state.pending_jobs:
+        show_pending_jobs()
+    elif st.session_state.product_store.invoice_count > st.session_state.batch_start:
+        # Mostrar tabla de productos de las últimas facturas
+        st.dataframe(products_frame(since_invoice=st.session_state.batch_start))
+    
+    if st.session_state.product_store and not st.session_state.pending_jobs:
+        if st.button("Finalizar y exportar"):
+            st.session_state.finished = True
+            st.rerun()
 
 # Procesar la entrada del usuario
 if user_input:
@@ -303,63 +308,21 @@ if user_input:
     st.chat_message("user").write(user_input)
     
     try:
-        thread = client.beta.threads.create()
-        message = client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=user_input
-        )
-        with client.beta.threads.runs.stream(
-            thread_id=thread.id,
-            assistant_id='asst_nnDTLYK0nrjuIBJCdscnA6vb',
-            event_handler=EventHandler()) as stream:
-                stream.until_done()
-                bot_response = stream.get_final_messages()
-                bot_reply = bot_response[0].content[0].text.value
-                bot_reply = re.sub(r"【.*?】", "", bot_reply)
-        
+        # La respuesta se va mostrando a medida que llega
+        bot_reply = st.chat_message("assistant", avatar=AVATAR).write_stream(
+            stream_chat_reply(get_client(), user_input, st.session_state.chat_session, faq=faq_cache))
         st.session_state.messages.append({"role": "assistant", "content": bot_reply, "avatar": "avatar.png"})
-        st.chat_message("assistant", avatar="avatar.png").write(bot_reply)
     except Exception as e:
         st.error(f"Error: {e}")
 
 # Si ya terminamos de procesar, mostrar el Excel
 if st.session_state.finished:    
     # Crear DataFrame y archivo Excel con datos a nivel de producto
-    if st.session_state.processed_products:
+    if st.session_state.product_store:
         try:
-            # Create DataFrame from processed products
-            df = pd.DataFrame(st.session_state.processed_products)
-            
-            # Function to create Excel file with multiple sheets if needed
-            def to_excel(df):
-                output = BytesIO()
-                writer = pd.ExcelWriter(output, engine='xlsxwriter')
-                
-                # Write dataframe to the Excel
-                df.to_excel(writer, sheet_name='Productos', index=False)
-                
-                # Configure formatting if needed
-                workbook = writer.book
-                worksheet = writer.sheets['Productos']
-                
-                # Adjust column widths
-                for idx, col in enumerate(df.columns):
-                    max_len = max(
-                        df[col].astype(str).map(len).max(),
-                        len(str(col))
-                    ) + 2
-                    worksheet.set_column(idx, idx, max_len)
-                
-                # Close the writer explicitly
-                writer.close()
-                
-                # Get the processed data
-                output.seek(0)  # Important: reset pointer
-                return output.getvalue()
-            
-            # Generate Excel data
-            excel_data = to_excel(df)
+            exporter = st.session_state.exporter
+            # Los archivos ya están escritos, solo falta cerrarlos
+            excel_data = exporter.excel_bytes()
             
             # Mostrar enlace de descarga
             st.session_state.messages.append({
@@ -367,10 +330,12 @@ if st.session_state.finished:
                 "content": "Aquí está el archivo Excel con todos los productos de las facturas procesadas:", 
                 "avatar": "avatar.png"
             })
-            st.chat_message("assistant", avatar="avatar.png").write("Aquí está el archivo Excel con todos los productos de las facturas procesadas:")
+            st.chat_message("assistant", avatar=AVATAR).write("Aquí está el archivo Excel con todos los productos de las facturas procesadas:")
             
-            # Mostrar DataFrame en chat
-            st.dataframe(df)
+            # Mostrar en chat las últimas filas (el archivo tiene todas)
+            st.dataframe(products_frame(last=PREVIEW_ROWS))
+            if exporter.rows > PREVIEW_ROWS:
+                st.caption(f"Mostrando las últimas {PREVIEW_ROWS} de {exporter.rows} filas.")
             
             # Enlace de descarga con nombre de archivo que incluye timestamp
             from datetime import datetime
@@ -381,16 +346,32 @@ if st.session_state.finished:
                 file_name=f"productos_facturas_{timestamp}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
+            st.download_button(
+                label="Descargar CSV",
+                data=exporter.csv_bytes(),
+                file_name=f"productos_facturas_{timestamp}.csv",
+                mime="text/csv"
+            )
+            parquet_data = exporter.parquet_bytes()
+            if parquet_data:
+                st.download_button(
+                    label="Descargar Parquet",
+                    data=parquet_data,
+                    file_name=f"productos_facturas_{timestamp}.parquet",
+                    mime="application/octet-stream"
+                )
             
             # Botón para reiniciar
             if st.button("Procesar nuevas facturas"):
-                st.session_state.processed_invoices = []
-                st.session_state.processed_products = []
+                st.session_state.product_store = ProductStore()
+                st.session_state.pop('products_frame', None)
+                st.session_state.exporter.discard()
+                st.session_state.exporter = IncrementalExporter()
                 st.session_state.finished = False
                 st.session_state.messages = [
                     {"role": "assistant", "content": "¡Hola! Soy DASSA-Bot. Sube una factura en PDF para procesarla. 🤖", "avatar": "avatar.png"}
                 ]
-                st.experimental_rerun()
+                st.rerun()
         except Exception as e:
             st.error(f"Error al generar el archivo Excel: {e}")
             import traceback
@@ -398,7 +379,7 @@ if st.session_state.finished:
             
             # Ofrecer alternativa para descargar CSV en caso de error con Excel
             try:
-                csv_data = df.to_csv(index=False).encode('utf-8')
+                csv_data = st.session_state.exporter.csv_bytes()
                 
                 st.download_button(
                     label="Descargar CSV (Alternativa)",
@@ -412,11 +393,13 @@ if st.session_state.finished:
         st.warning("No se procesaron facturas.")
         # Botón para reiniciar
         if st.button("Procesar facturas"):
-            st.session_state.processed_invoices = []
-            st.session_state.processed_products = []
+            st.session_state.product_store = ProductStore()
+            st.session_state.pop('products_frame', None)
+            st.session_state.exporter.discard()
+            st.session_state.exporter = IncrementalExporter()
             st.session_state.finished = False
             st.session_state.messages = [
                 {"role": "assistant", "content": "¡Hola! Soy DASSA-Bot. Sube una factura en PDF para procesarla. 🤖", "avatar": "avatar.png"}
             ]
-            st.experimental_rerun()
+            st.rerun()
 
@@ -1,67 +1,70 @@
 import streamlit as st
-from openai import OpenAI
-from openai import AssistantEventHandler
-from typing_extensions import override
 import os
-import re
+from assistant_backend import ASSISTANT_ID, ChatSession, make_client, stream_chat_reply
+from faq_cache import FAQCache
 try:
   from tokens import openai_key
 except ImportError:
   openai_key = os.getenv('OPENAI_API_KEY')
 
-class EventHandler(AssistantEventHandler):
-    @override    
-    def on_text_created(self, text) -> None:
-        print(f"\nassistant > ", end="", flush=True)
-    @override     
-    def on_text_delta(self, delta, snapshot):
-        print(delta.value, end="", flush=True)
-        
-def on_tool_call_created(self, tool_call):
-  print(f"\nassistant > {tool_call.type}\n", flush=True)
+# Mensajes del historial que se dibujan en cada rerun; los anteriores quedan detrás de un toggle
+HISTORY_RENDER = 30
 
-def on_tool_call_delta(self, delta, snapshot):
-  if delta.type == 'code_interpreter':
-    if delta.code_interpreter.input:
-      print(delta.code_interpreter.input, end="", flush=True)
-    if delta.code_interpreter.outputs:
-      print(f"\n\noutput >", flush=True)
-      for output in delta.code_interpreter.outputs:
-        if output.type == "logs":
-          print(f"\n{output.logs}", flush=True)
+@st.cache_data
+def load_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+AVATAR = load_image('avatar.png')
 
 col_title, col_logo = st.columns([5, 1])
 with col_title:
   st.title("DASSA Bot")
 with col_logo:
-  st.image('logo.png')
+  st.image(load_image('logo.png'))
+
+# El cliente se crea una vez y recién con el primer mensaje
+@st.cache_resource
+def get_client():
+    return make_client(openai_key)
 
-client = OpenAI(
-    api_key=openai_key)
+@st.cache_resource
+def get_faq_cache():
+    return FAQCache(version=ASSISTANT_ID)
+
+# El thread y el historial se conservan entre reruns
+if 'chat_session' not in st.session_state:
+    st.session_state.chat_session = ChatSession()
+    st.session_state.chat_history = []
 
 # Initial bot message
-st.chat_message("assistant", avatar="avatar.png").write("Hola! Soy DASSA-Bot. En qué te puedo ayudar? 🤖")
+st.chat_message("assistant", avatar=AVATAR).write("Hola! Soy DASSA-Bot. En qué te puedo ayudar? 🤖")
+
+def show_message(role, content):
+    st.chat_message(role, avatar=AVATAR if role == "assistant" else None).write(content)
+
+@st.fragment
+def show_older_messages(messages):
+    # El toggle vuelve a correr solo este fragmento, no la app entera
+    if st.toggle(f"Ver {len(messages)} mensajes anteriores"):
+        for role, content in messages:
+            show_message(role, content)
+
+older = st.session_state.chat_history[:-HISTORY_RENDER]
+if older:
+    show_older_messages(older)
+for role, content in st.session_state.chat_history[-HISTORY_RENDER:]:
+    show_message(role, content)
 
 user_input = st.chat_input("Ingresa tu mensaje...")
 
 if user_input:
+    st.chat_message("user").write(user_input)
     try:
-        thread = client.beta.threads.create()
-        message = client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=user_input
-        )
-        with client.beta.threads.runs.stream(
-            thread_id=thread.id,
-            assistant_id='asst_nnDTLYK0nrjuIBJCdscnA6vb',
-            event_handler=EventHandler()) as stream:
-                stream.until_done()
-                bot_response = stream.get_final_messages()
-                bot_reply = bot_response[0].content[0].text.value
-                bot_reply = re.sub(r"【.*?】", "", bot_reply)
-        st.chat_message("user").write(user_input)
-        st.chat_message("assistant", avatar="avatar.png").write(bot_reply)
+        # La respuesta se va mostrando a medida que llega
+        bot_reply = st.chat_message("assistant", avatar=AVATAR).write_stream(
+            stream_chat_reply(get_client(), user_input, st.session_state.chat_session, faq=get_faq_cache()))
+        st.session_state.chat_history.append(("user", user_input))
+        st.session_state.chat_history.append(("assistant", bot_reply))
     except Exception as e:
         st.error(f"Error: {e}")
-
@@ -0,0 +1,357 @@
+"""Llamadas al modelo: extracción de facturas y chat con el asistente.
+
+Para las facturas hay dos modos:
+- 'structured': una sola llamada a chat.completions con la respuesta restringida
+  por un JSON schema (1 request HTTP por factura).
+- 'threads': el camino original con el asistente (crear thread, mensaje y run en
+  streaming, al menos 3 requests por factura). Queda como alternativa.
+
+Todas las llamadas pasan por el Scheduler de rate_limit.py (límite de requests,
+reintentos y plazos); el cliente de make_client no reintenta por su cuenta.
+"""
+import json
+import math
+import os
+import re
+import time
+from dataclasses import dataclass, field
+
+import metrics
+from afip_parser import check_items_total, parse_afip_invoice
+from json_repair import parse_json_lenient
+from pdf_text import prompt_parts
+from product_store import parse_ar_number
+from rate_limit import STREAM_IDLE_TIMEOUT, DeadlineExceeded, RetryableError, event_hooks, get_scheduler, is_timeout
+
+ASSISTANT_ID = 'asst_nnDTLYK0nrjuIBJCdscnA6vb'
+# Incrementar al cambiar el prompt de facturas, así no se reutilizan resultados viejos del caché
+PROMPT_VERSION = '1'
+CITATION_RE = re.compile(r"【.*?】")
+# Turnos de chat (pregunta y respuesta) que el modelo ve completos; los anteriores van resumidos
+HISTORY_WINDOW = 6
+
+BACKENDS = ('structured', 'threads')
+DEFAULT_BACKEND = os.getenv('DASSA_INVOICE_BACKEND', 'structured')
+INVOICE_MODEL = os.getenv('DASSA_INVOICE_MODEL', 'gpt-4o-mini')
+# Plazo total en segundos (con reintentos) para extraer una factura y para empezar a responder en el chat
+INVOICE_DEADLINE = 180
+CHAT_DEADLINE = 60
+
+def cache_version(backend=DEFAULT_BACKEND):
+    """Versión de los resultados guardados en el caché de facturas.
+
+    Incluye el modo y el modelo: cambiar de modo para rehacer una extracción mala no
+    tiene que devolver el resultado del otro. En 'threads' el modelo lo fija el asistente.
+    """
+    version = f"{ASSISTANT_ID}:{PROMPT_VERSION}:{backend}"
+    return version if backend == 'threads' else f"{version}:{INVOICE_MODEL}"
+
+# Errores de un run de asistente que vale la pena reintentar
+RETRYABLE_RUN_ERRORS = ('rate_limit_exceeded', 'server_error')
+
+INVOICE_PROMPT = """Extraé la siguiente información de esta factura en formato JSON válido:
+        {{
+        "Fecha": "...",
+        "Número de Factura": "...",
+        "CUIT Emisor": "...",
+        "Cliente": "...",
+        "Importe Total": "...",
+        "IVA": "...",
+        "Detalle de Productos": [
+            {{"Descripción": "...", "Cantidad": "...", "Precio Unitario": "...", "Subtotal": "..."}}
+        ]
+        }}
+
+        Es muy importante que:
+        1. El formato sea JSON válido con comillas dobles para las claves
+        2. 'Detalle de Productos' sea un array de objetos con la información de cada producto
+        3. No agregues comentarios ni texto adicional en la respuesta, solo el JSON
+
+        El texto de la factura es:
+        {pdf_text}"""
+
+_PRODUCT_FIELDS = ('Descripción', 'Cantidad', 'Precio Unitario', 'Subtotal')
+_HEADER_FIELDS = ('Fecha', 'Número de Factura', 'CUIT Emisor', 'Cliente', 'Importe Total', 'IVA')
+
+# Prefijo fijo del pedido de resumen: no cambia entre llamadas, así aplica el caché de prompts
+SUMMARY_PROMPT = """Resumí en español, en no más de 10 líneas, esta conversación entre un cliente y DASSA-Bot.
+Conservá datos concretos (nombres, números de contenedor, fechas, montos) y los pedidos pendientes."""
+
+INVOICE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        **{field: {'type': 'string'} for field in _HEADER_FIELDS},
+        'Detalle de Productos': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {field: {'type': 'string'} for field in _PRODUCT_FIELDS},
+                'required': list(_PRODUCT_FIELDS),
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': [*_HEADER_FIELDS, 'Detalle de Productos'],
+    'additionalProperties': False,
+}
+
+# El SDK de openai tarda en importarse: se carga recién al crear el cliente, así la app
+# dibuja la pantalla sin esperarlo
+def make_client(api_key, base_url=None):
+    """Cliente de OpenAI; conviene crearlo una sola vez y reutilizarlo (mantiene el pool de conexiones)."""
+    from openai import DefaultHttpxClient, OpenAI
+    # Los reintentos los hace el Scheduler, que además respeta el límite de requests
+    return OpenAI(api_key=api_key, base_url=base_url or os.getenv('OPENAI_BASE_URL'), max_retries=0,
+                  http_client=DefaultHttpxClient(event_hooks=event_hooks()))
+
+def process_invoice_structured(client, pdf_text, model=INVOICE_MODEL):
+    prompt = INVOICE_PROMPT.format(pdf_text=pdf_text)
+
+    def request(timeout):
+        response = client.with_options(timeout=timeout).chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "factura", "schema": INVOICE_SCHEMA, "strict": True},
+            },
+        )
+        # Acá y no afuera: si el pedido se duplicó, las dos respuestas se pagan
+        if response.usage:
+            metrics.record_usage(response.model, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response
+    # El pedido no tiene efectos, así que se puede duplicar si tarda demasiado
+    response = get_scheduler().call(request, time.monotonic() + INVOICE_DEADLINE, name='structured', hedge=True)
+    choice = response.choices[0]
+    if choice.finish_reason == 'length':
+        # El JSON quedó a medias: faltan productos o importes aunque el resto se pueda leer
+        raise TruncatedReplyError("La respuesta del modelo se cortó por el límite de tokens")
+    return choice.message.content or ""
+
+def process_invoice_with_ai(client, pdf_text):
+    # Cada intento usa un thread nuevo: uno que quedó a medias puede tener un run activo
+    def attempt(timeout):
+        deadline = time.monotonic() + timeout
+        return _invoice_thread(client.with_options(timeout=min(timeout, STREAM_IDLE_TIMEOUT)), pdf_text, deadline)
+    return get_scheduler().call(attempt, time.monotonic() + INVOICE_DEADLINE, name='threads')
+
+def _invoice_thread(client, pdf_text, deadline):
+    thread = client.beta.threads.create()
+    message = client.beta.threads.messages.create(
+        thread_id=thread.id,
+        role="user",
+        content=INVOICE_PROMPT.format(pdf_text=pdf_text)
+    )
+
+    with client.beta.threads.runs.stream(
+        thread_id=thread.id,
+        assistant_id=ASSISTANT_ID) as stream:
+            for _ in stream:
+                if time.monotonic() > deadline:
+                    raise DeadlineExceeded("La extracción de la factura superó el plazo")
+            run = stream.current_run
+            if run is not None and run.status == 'failed':
+                error = run.last_error
+                if error is not None and error.code in RETRYABLE_RUN_ERRORS:
+                    raise RetryableError(f"{error.code}: {error.message}")
+                raise RuntimeError(f"El run falló: {error.message if error else run.status}")
+            bot_response = stream.get_final_messages()
+            bot_reply = bot_response[0].content[0].text.value
+            bot_reply = CITATION_RE.sub("", bot_reply)
+            if run is not None and run.usage:
+                metrics.record_usage(run.model, run.usage.prompt_tokens, run.usage.completion_tokens)
+
+    return bot_reply
+
+def process_invoice_remote(client, pdf_text, backend=DEFAULT_BACKEND):
+    """Extrae la factura con el modelo usando el modo elegido ('structured' o 'threads').
+
+    Si el texto no entra en un prompt (ver pdf_text.prompt_parts) se manda en partes y
+    se devuelve el JSON de las partes combinadas.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Modo de extracción desconocido: {backend}")
+    extract = process_invoice_with_ai if backend == 'threads' else process_invoice_structured
+    parts = prompt_parts(pdf_text)
+    with metrics.span('llm_request', backend=backend, parts=len(parts)):
+        if len(parts) == 1:
+            return extract(client, parts[0])
+        replies = [extract(client, f"(Parte {number} de {len(parts)} de la factura)\n{part}")
+                   for number, part in enumerate(parts, start=1)]
+    return json.dumps(merge_parts(replies), ensure_ascii=False)
+
+def merge_parts(replies):
+    """Combina las respuestas de una factura mandada en partes: un encabezado y todos los renglones."""
+    invoice = dict.fromkeys(_HEADER_FIELDS, '')
+    products = []
+    for number, reply in enumerate(replies, start=1):
+        part, error = parse_json_lenient(reply)
+        if not isinstance(part, dict):
+            raise ValueError(f"No se pudo leer la parte {number} de {len(replies)} de la factura: "
+                             f"{error or 'no es un objeto JSON'}")
+        for name in _HEADER_FIELDS:
+            value = part.get(name)
+            # El encabezado está en la primera parte; el total y el IVA, en la última
+            if value and (not invoice[name] or name in ('Importe Total', 'IVA')):
+                invoice[name] = value
+        if isinstance(part.get('Detalle de Productos'), list):
+            products += part['Detalle de Productos']
+    invoice['Detalle de Productos'] = products
+    return invoice
+
+def check_items(invoice_dict, pdf_text):
+    """Aviso si los renglones de la factura no suman el neto del texto (al modelo se le pudo pasar alguno)."""
+    products = invoice_dict.get('Detalle de Productos')
+    if not isinstance(products, list):
+        return None
+    subtotals = (parse_ar_number(product.get('Subtotal')) for product in products if isinstance(product, dict))
+    return check_items_total([0.0 if math.isnan(value) else value for value in subtotals], pdf_text)
+
+def process_invoice(client, pdf_text, backend=DEFAULT_BACKEND):
+    """Lee localmente las facturas AFIP bien formadas y solo consulta al modelo si no alcanza."""
+    invoice_dict, _ = parse_afip_invoice(pdf_text)
+    if invoice_dict:
+        return json.dumps(invoice_dict, ensure_ascii=False)
+    return process_invoice_remote(client, pdf_text, backend)
+
+class TruncatedReplyError(ValueError):
+    pass
+
+class CitationStripper:
+    """Saca las citas 【...】 de un texto que llega en pedazos.
+
+    Si un pedazo deja una cita abierta, se retiene desde el 【 hasta que llega el 】
+    (o hasta MAX_PENDING caracteres, por si no era una cita).
+    """
+    MAX_PENDING = 200
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text):
+        text = CITATION_RE.sub("", self._pending + text)
+        start = text.rfind("【")
+        if start != -1 and len(text) - start <= self.MAX_PENDING:
+            self._pending = text[start:]
+            return text[:start]
+        self._pending = ""
+        return text
+
+    def flush(self):
+        text, self._pending = self._pending, ""
+        return text
+
+@dataclass
+class ChatSession:
+    """Conversación de una sesión: el thread se reutiliza entre mensajes."""
+    thread_id: str = None
+    turns: list = field(default_factory=list)  # [(pregunta, respuesta)] que todavía no se resumieron
+    summary: str = ""
+    # Turnos respondidos desde el caché de preguntas frecuentes, que el thread todavía no tiene
+    pending: list = field(default_factory=list)
+
+    def add_local_turn(self, question, answer):
+        self.turns.append((question, answer))
+        self.pending += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+def summarize_turns(client, summary, turns, model=INVOICE_MODEL, deadline=None):
+    conversation = "\n".join(f"Cliente: {question}\nDASSA-Bot: {answer}" for question, answer in turns)
+    if summary:
+        conversation = f"Resumen de lo anterior: {summary}\n\n{conversation}"
+    response = get_scheduler().call(
+        lambda timeout: client.with_options(timeout=timeout).chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": conversation}],
+        ),
+        deadline or time.monotonic() + CHAT_DEADLINE, name='summary')
+    if response.usage:
+        metrics.record_usage(response.model, response.usage.prompt_tokens, response.usage.completion_tokens)
+    return response.choices[0].message.content or summary
+
+def _compact_history(client, session, deadline):
+    # Cada HISTORY_WINDOW turnos se resumen los más viejos; entre resúmenes el texto
+    # de additional_instructions no cambia y el prefijo del prompt se puede cachear
+    if len(session.turns) < 2 * HISTORY_WINDOW:
+        return
+    old, session.turns = session.turns[:-HISTORY_WINDOW], session.turns[-HISTORY_WINDOW:]
+    session.summary = summarize_turns(client, session.summary, old, deadline=deadline)
+
+def stream_chat_reply(client, user_input, session=None, faq=None):
+    """Genera la respuesta del asistente a medida que llega (para st.write_stream).
+
+    Con una ChatSession se reutiliza su thread: el mensaje va en el mismo request del
+    run, el modelo ve solo los últimos turnos y lo anterior llega como resumen.
+    Con un FAQCache, las preguntas ya respondidas se contestan sin llamar a la API.
+    """
+    start = time.perf_counter()
+    session = session or ChatSession()
+    if faq is not None:
+        with metrics.span('faq_lookup') as labels:
+            cached = faq.get(user_input)
+            labels['hit'] = cached is not None
+        if cached is not None:
+            session.add_local_turn(user_input, cached)
+            yield cached
+            return
+    # Solo se guardan respuestas a preguntas que abren la conversación (no dependen de lo anterior)
+    first_turn = not session.turns and not session.summary
+    scheduler = get_scheduler()
+    deadline = time.monotonic() + CHAT_DEADLINE
+    if session.thread_id is None:
+        session.thread_id = scheduler.call(
+            lambda timeout: client.with_options(timeout=timeout).beta.threads.create(), deadline, name='thread').id
+    _compact_history(client, session, deadline)
+    run_options = {
+        # Los turnos sin resumir (pregunta y respuesta) más la pregunta nueva
+        "truncation_strategy": {"type": "last_messages", "last_messages": 2 * len(session.turns) + 1},
+    }
+    if session.summary:
+        run_options["additional_instructions"] = f"Resumen de la conversación anterior: {session.summary}"
+    stripper = CitationStripper()
+    first_token = None
+    reply = []
+    attempt = 0
+    while True:
+        stream = None
+        try:
+            timeout = min(deadline - time.monotonic(), STREAM_IDLE_TIMEOUT)
+            with scheduler.deadline(deadline), client.with_options(timeout=timeout).beta.threads.runs.stream(
+                    thread_id=session.thread_id,
+                    assistant_id=ASSISTANT_ID,
+                    additional_messages=[*session.pending, {"role": "user", "content": user_input}],
+                    **run_options) as stream:
+                for delta in stream.text_deltas:
+                    text = stripper.feed(delta)
+                    if not text:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        metrics.record({'type': 'span', 'stage': 'chat_ttft', 'seconds': first_token, 'ok': True})
+                    reply.append(text)
+                    yield text
+                run = stream.current_run
+                if run is not None and run.usage:
+                    metrics.record_usage(run.model, run.usage.prompt_tokens, run.usage.completion_tokens)
+            break
+        except Exception as e:
+            # Solo se reintenta si el run no llegó a crearse: si no, la pregunta ya está en el
+            # thread (y quizás parte de la respuesta en pantalla)
+            delay = None
+            if stream is None or stream.current_run is None:
+                delay = scheduler.retry_delay(e, attempt, deadline)
+            if delay is None:
+                if is_timeout(e):
+                    raise DeadlineExceeded("El asistente dejó de responder; probá de nuevo en un momento") from e
+                raise
+            scheduler.note_retry('chat', e, attempt, delay)
+            time.sleep(delay)
+            attempt += 1
+    tail = stripper.flush()
+    if tail:
+        reply.append(tail)
+        yield tail
+    session.pending = []
+    session.turns.append((user_input, "".join(reply)))
+    if faq is not None and first_turn:
+        faq.put(user_input, session.turns[-1][1])
+    metrics.record({'type': 'span', 'stage': 'chat_total', 'seconds': time.perf_counter() - start, 'ok': True})
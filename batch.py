@@ -0,0 +1,62 @@
+"""Procesamiento por lotes: lectura de PDFs en un pool de procesos y consultas
+al asistente en un pool de hilos acotado."""
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from pdf_text import extract_text_from_bytes
+
+# Máximo de consultas simultáneas al asistente
+AI_WORKERS = 4
+
+@dataclass
+class BatchResult:
+    index: int
+    name: str
+    status: str = "pdf"  # pdf -> ai -> ok | error
+    pdf_text: Optional[str] = None
+    reply: Optional[str] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def done(self):
+        return self.status in ("ok", "error")
+
+def iter_batch(files, process_fn, pdf_workers=None, ai_workers=AI_WORKERS):
+    """Procesa una lista de (nombre, bytes) y va devolviendo BatchResult a medida que avanzan.
+
+    `process_fn(nombre, texto)` corre en el pool de hilos. Cada factura se devuelve una vez
+    al terminar de leer el PDF (status 'ai') y otra al terminar (status 'ok' o 'error').
+    Un error en una factura no corta el resto del lote.
+    """
+    if not files:
+        return
+    pdf_workers = pdf_workers or min(len(files), os.cpu_count() or 1)
+    # spawn: no conviene hacer fork del servidor de Streamlit con sus hilos corriendo
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=pdf_workers, mp_context=ctx) as pdf_pool, \
+            ThreadPoolExecutor(max_workers=ai_workers) as ai_pool:
+        pending = {}
+        for index, (name, data) in enumerate(files):
+            pending[pdf_pool.submit(extract_text_from_bytes, data)] = BatchResult(index, name)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = pending.pop(future)
+                try:
+                    value: Any = future.result()
+                except Exception as e:
+                    result.status = "error"
+                    result.error = e
+                    yield result
+                    continue
+                if result.status == "pdf":
+                    result.pdf_text = value
+                    result.status = "ai"
+                    pending[ai_pool.submit(process_fn, result.name, value)] = result
+                else:
+                    result.reply = value
+                    result.status = "ok"
+                yield result
@@ -0,0 +1,40 @@
+"""Compara los modos de extracción 'structured' y 'threads' contra el servidor mock.
+
+    python -m bench.backends --invoices 20 --latency 0.2
+"""
+import argparse
+import statistics
+import time
+
+from assistant_backend import BACKENDS, make_client, process_invoice_remote
+from bench.mock_openai import MockOpenAI
+
+SAMPLE_TEXT = "FACTURA A\nCUIT: 20-12345678-6\nAlmacenaje contenedor 2,00 unidades 500,00\nImporte Total: $ 1.331,00"
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.1, help="latencia simulada por request (s)")
+    args = parser.parse_args()
+
+    with MockOpenAI(latency=args.latency) as mock:
+        client = make_client('mock', base_url=mock.base_url)
+        print(f"{'modo':<12}{'req/factura':>12}{'p50 (s)':>10}{'p95 (s)':>10}{'total (s)':>11}")
+        for backend in BACKENDS:
+            mock.reset()
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(args.invoices):
+                t0 = time.perf_counter()
+                process_invoice_remote(client, SAMPLE_TEXT, backend)
+                latencies.append(time.perf_counter() - t0)
+            total = time.perf_counter() - start
+            print(f"{backend:<12}{mock.requests / args.invoices:>12.1f}{statistics.median(latencies):>10.3f}"
+                  f"{percentile(latencies, 95):>10.3f}{total:>11.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Verifica que el caché de preguntas frecuentes no responda con respuestas de otra pregunta.
+
+    python -m bench.faq_check
+
+Cada caso guarda una pregunta y su respuesta, y consulta otra: se espera la respuesta
+guardada (parafraseos, plurales, errores de tipeo) o ninguna (otro contenedor, una
+pregunta más general que la guardada).
+"""
+import os
+import tempfile
+
+from faq_cache import FAQCache
+
+# (pregunta guardada, respuesta, pregunta nueva, se espera la respuesta guardada)
+CASES = [
+    ("¿Cuál es el estado del contenedor MSCU1234567?", "Tu contenedor MSCU1234567 está liberado.",
+     "¿Cuál es el estado del contenedor MSCU1234568?", False),
+    ("¿Cuál es el estado del contenedor MSCU1234567?", "Tu contenedor MSCU1234567 está liberado.",
+     "¿Cuál es el estado del contenedor MSCU1234567?", False),
+    ("¿Cuánto sale almacenar 2 contenedores?", "Dos contenedores cuestan $ 1.331,00 por día.",
+     "¿Cuánto sale almacenar 3 contenedores?", False),
+    ("¿Cuál es el horario de atención los sábados?", "Los sábados atendemos de 8 a 12.",
+     "¿Cuál es el horario de atención?", False),
+    ("¿Cuál es el horario de atención?", "Atendemos de lunes a viernes de 8 a 17.",
+     "¿Cuál es el horario de atención los sábados?", False),
+    ("¿Cuál es el horario de atención?", "Atendemos de lunes a viernes de 8 a 17.",
+     "Hola, cual es el horario de atencion", True),
+    ("¿Cuál es el horario de atención?", "Atendemos de lunes a viernes de 8 a 17.",
+     "¿cual es el horaro de atención?", True),
+    ("¿Qué documentos necesito para retirar un contenedor?", "Necesitás el BL y el libre deuda.",
+     "¿Qué documentos necesito para retirar contenedores?", True),
+]
+
+def main():
+    failures = 0
+    for stored, answer, asked, expected in CASES:
+        with tempfile.TemporaryDirectory() as tmp:
+            faq = FAQCache(os.path.join(tmp, 'faq.sqlite3'))
+            faq.put(stored, answer)
+            got = faq.get(asked)
+            if (got == answer) != expected:
+                failures += 1
+                print(f"FALLA: guardada {stored!r}, consulta {asked!r} -> {got!r}")
+    print(f"{len(CASES) - failures}/{len(CASES)} casos correctos")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
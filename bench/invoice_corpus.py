@@ -0,0 +1,129 @@
+"""Facturas sintéticas en PDF y respuestas del asistente para esas facturas.
+
+Los PDFs se arman a mano (texto Helvetica, sin dependencias) con encabezado, renglones,
+totales y copias DUPLICADO al final, como las facturas reales. `invoice_reply` es una
+respuesta para MockOpenAI que lee la factura del prompt y devuelve su JSON; una parte
+de las respuestas sale mal formada (bloque ```json, comillas simples, comas de más o
+texto alrededor) para ejercitar el parser tolerante.
+"""
+import json
+import random
+import re
+
+# Renglones por factura de cada tamaño (las grandes ocupan varias páginas)
+SIZES = {'chica': 5, 'mediana': 40, 'grande': 250}
+LINES_PER_PAGE = 60
+# 'truncated' no está: una respuesta cortada se rechaza (ver json_repair.py), no se repara
+MALFORMED_KINDS = ('fence', 'single_quotes', 'trailing_comma', 'prose')
+
+_NUMBER_RE = re.compile(r'Comprobante Nro: (\d{5}-\d{8})')
+_CUIT_RE = re.compile(r'CUIT: (\d{2}-\d{8}-\d)')
+_CLIENT_RE = re.compile(r'Cliente: (.+)')
+_DATE_RE = re.compile(r'Fecha: (\d{2}/\d{2}/\d{4})')
+_ITEM_RE = re.compile(r'^(Item .+?) {2,}(\S+) {2,}(\S+) {2,}(\S+)$', re.M)
+_TOTAL_RE = re.compile(r'Importe Total: \$ (\S+)')
+_IVA_RE = re.compile(r'IVA 21%: \$ (\S+)')
+
+def ar_amount(value):
+    """1234.5 -> '1.234,50'"""
+    return f"{value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+def invoice_text(number, items, seed=0):
+    """Texto de una factura con `items` renglones, en páginas de LINES_PER_PAGE líneas."""
+    rng = random.Random(seed * 100003 + number)
+    header = [
+        "FACTURA B",
+        f"Comprobante Nro: {number % 50 + 1:05d}-{number:08d}",
+        f"Fecha: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024",
+        "CUIT: 20-12345678-6",
+        f"Cliente: CLIENTE {number} SRL",
+        "Descripcion  Cantidad  Precio Unitario  Subtotal",
+    ]
+    lines, neto = [], 0.0
+    for i in range(items):
+        qty, price = rng.randint(1, 20), rng.randint(100, 500000) / 100
+        neto += qty * price
+        lines.append(f"Item {i + 1} contenedor {rng.choice(['20DV', '40HC', '40RF'])}  "
+                     f"{ar_amount(qty)}  {ar_amount(price)}  {ar_amount(qty * price)}")
+    iva = round(neto * 0.21, 2)
+    totals = [f"Subtotal: $ {ar_amount(neto)}", f"IVA 21%: $ {ar_amount(iva)}", f"Importe Total: $ {ar_amount(neto + iva)}"]
+    body = header + lines + totals
+    pages = [body[i:i + LINES_PER_PAGE] for i in range(0, len(body), LINES_PER_PAGE)]
+    # Copia para el cliente: PyPDF2 no llega a leerla porque corta después de los totales
+    pages.append(["DUPLICADO"] + header[1:])
+    return pages
+
+def make_pdf(pages):
+    """PDF mínimo con una página por lista de líneas."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        page_id, content_id = len(objects) + 1, len(objects) + 2
+        kids.append(f"{page_id} 0 R")
+        text = " ".join("(" + line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ") '" for line in lines)
+        stream = f"BT /F1 9 Tf 40 810 Td 12 TL {text} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode('latin-1')
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+def make_corpus(count, mix=None, seed=0):
+    """Lista de (nombre, bytes del PDF) con tamaños según `mix` ({tamaño: peso})."""
+    mix = mix or {'chica': 6, 'mediana': 3, 'grande': 1}
+    rng = random.Random(seed)
+    sizes = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [(f"factura_{i:05d}_{size}.pdf", make_pdf(invoice_text(i, SIZES[size], seed))) for i, size in enumerate(sizes)]
+
+def _prompt(body):
+    if 'messages' in body:
+        return body['messages'][-1]['content']
+    return '\n'.join(body.get('thread_messages', []))
+
+def invoice_reply(malformed=0.0):
+    """Respuesta para MockOpenAI: el JSON de la factura del prompt, mal formado con probabilidad `malformed`."""
+    def reply(body):
+        text = _prompt(body)
+        number = _NUMBER_RE.search(text)
+        invoice = {
+            "Fecha": (_DATE_RE.search(text) or [None, ""])[1],
+            "Número de Factura": number.group(1) if number else "",
+            "CUIT Emisor": (_CUIT_RE.search(text) or [None, ""])[1],
+            "Cliente": (_CLIENT_RE.search(text) or [None, ""])[1].strip(),
+            "Importe Total": (_TOTAL_RE.search(text) or [None, ""])[1],
+            "IVA": (_IVA_RE.search(text) or [None, ""])[1],
+            "Detalle de Productos": [
+                {"Descripción": m.group(1), "Cantidad": m.group(2), "Precio Unitario": m.group(3), "Subtotal": m.group(4)}
+                for m in _ITEM_RE.finditer(text)
+            ],
+        }
+        # La misma factura recibe siempre la misma respuesta, sin importar el orden de llegada
+        rng = random.Random(invoice["Número de Factura"])
+        if rng.random() >= malformed:
+            return json.dumps(invoice, ensure_ascii=False)
+        return malform(invoice, rng.choice(MALFORMED_KINDS))
+    return reply
+
+def malform(invoice, kind):
+    text = json.dumps(invoice, ensure_ascii=False, indent=2)
+    if kind == 'fence':
+        return f"```json\n{text}\n```"
+    if kind == 'single_quotes':
+        return str(invoice)
+    if kind == 'trailing_comma':
+        return text.replace('"\n  }', '",\n  }').replace('}\n  ]', '},\n  ]')
+    if kind == 'prose':
+        return f"Claro, acá está la información de la factura:\n{text}\nAvisame si necesitás algo más."
+    if kind == 'truncated':
+        return text[:int(len(text) * 0.9)]
+    raise ValueError(kind)
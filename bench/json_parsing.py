@@ -0,0 +1,59 @@
+"""Verifica el corpus de respuestas mal formadas y mide el throughput de parse_json_lenient.
+
+    python -m bench.json_parsing --repeat 200
+"""
+import argparse
+import json
+import os
+import time
+
+from json_repair import parse_json_lenient
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'json_corpus.jsonl')
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def large_reply(products):
+    """Respuesta grande con comillas simples y comas de más, para forzar el camino tolerante."""
+    items = ",\n".join(
+        f"    {{'Descripción': 'Item {i}: pallet {i % 7}', 'Cantidad': '{i % 9 + 1},00', "
+        f"'Precio Unitario': '1.{i % 1000:03d},50', 'Subtotal': '{i},00',}}"
+        for i in range(products)
+    )
+    return f"```json\n{{'Fecha': '15/03/2024', 'Detalle de Productos': [\n{items},\n]}}\n```"
+
+def throughput(texts, repeat):
+    size = sum(len(t.encode('utf-8')) for t in texts) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse_json_lenient(text)
+    elapsed = time.perf_counter() - start
+    return len(texts) * repeat / elapsed, size / elapsed / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--products', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    failures = 0
+    for case in corpus:
+        obj, error = parse_json_lenient(case['input'])
+        if obj != case['expected']:
+            failures += 1
+            print(f"FALLA {case['name']}: {obj!r} ({error})")
+    print(f"corpus: {len(corpus) - failures}/{len(corpus)} casos correctos")
+
+    per_sec, mb_sec = throughput([case['input'] for case in corpus], args.repeat)
+    print(f"corpus: {per_sec:,.0f} respuestas/s, {mb_sec:.2f} MB/s")
+    big = large_reply(args.products)
+    per_sec, mb_sec = throughput([big], max(1, args.repeat // 50))
+    print(f"respuesta de {args.products} productos ({len(big) / 1e6:.2f} MB): {per_sec:,.1f} respuestas/s, {mb_sec:.2f} MB/s")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,285 @@
+"""Servidor local que imita lo justo de la API de OpenAI para hacer benchmarks sin gastar.
+
+Atiende chat.completions y el camino de asistentes (threads, messages y runs en
+streaming), con una latencia configurable y un contador de requests por endpoint.
+La función `reply` recibe el body del request; en los runs se le agregan los mensajes
+del thread en 'thread_messages', para poder responder según el prompt.
+
+Para probar los reintentos (rate_limit.py) puede imitar los límites de la API:
+- `rpm`: requests por minuto; cada respuesta lleva los encabezados x-ratelimit-* y al
+  pasarse responde 429 con retry-after-ms.
+- `error_rate`: fracción de requests que reciben un 429 aunque haya cupo.
+- `stall_rate` / `stall`: fracción de respuestas que se quedan `stall` segundos sin
+  mandar nada (los streams después del primer evento, como un run colgado).
+
+    with MockOpenAI(latency=0.2) as mock:
+        client = make_client('mock', base_url=mock.base_url)
+"""
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_INVOICE = {
+    "Fecha": "15/03/2024",
+    "Número de Factura": "00003-00001234",
+    "CUIT Emisor": "20123456786",
+    "Cliente": "CLIENTE SRL",
+    "Importe Total": "1.331,00",
+    "IVA": "231,00",
+    "Detalle de Productos": [
+        {"Descripción": "Almacenaje contenedor", "Cantidad": "2,00", "Precio Unitario": "500,00", "Subtotal": "1.000,00"},
+        {"Descripción": "Manipuleo", "Cantidad": "1,00", "Precio Unitario": "100,00", "Subtotal": "100,00"},
+    ],
+}
+
+def canned_reply(body):
+    return json.dumps(CANNED_INVOICE, ensure_ascii=False)
+
+class MockOpenAI:
+    def __init__(self, latency=0.0, chunk_delay=0.0, chunk_size=20, reply=canned_reply, port=0,
+                 rpm=None, error_rate=0.0, stall_rate=0.0, stall=5.0, seed=0):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.reply = reply
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.counts = Counter()
+        self.rejected = Counter()  # 429 por motivo: 'limit' o 'injected'
+        self._random = random.Random(seed)
+        self._level = self._burst
+        self._updated = time.monotonic()
+        self.threads = defaultdict(list)  # thread -> textos de los mensajes de usuario
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _make_handler(self))
+        self._server.daemon_threads = True
+        # Los clientes cortan las respuestas colgadas: no hace falta el traceback de cada una
+        self._server.handle_error = lambda request, address: None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return sum(self.counts.values())
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.rejected.clear()
+            self.threads.clear()
+            self._level = self._burst
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def next_id(self, prefix):
+        with self._lock:
+            return f"{prefix}_{next(self._ids)}"
+
+    def count(self, endpoint):
+        with self._lock:
+            self.counts[endpoint] += 1
+
+    @property
+    def _burst(self):
+        # Como la API: el límite por minuto se aplica por segundo
+        return max(1, (self.rpm or 0) / 60)
+
+    def admit(self):
+        """Decide si se atiende un request: devuelve (encabezados, motivo del 429 o None)."""
+        with self._lock:
+            headers = {}
+            if self.rpm:
+                now = time.monotonic()
+                self._level = min(self._burst, self._level + (now - self._updated) * self.rpm / 60)
+                self._updated = now
+                limited = self._level < 1
+                if not limited:
+                    self._level -= 1
+                wait = (1 - self._level) * 60 / self.rpm if self._level < 1 else 0
+                headers = {
+                    'x-ratelimit-limit-requests': str(self.rpm),
+                    'x-ratelimit-remaining-requests': str(max(0, int(self._level))),
+                    'x-ratelimit-reset-requests': f"{(self._burst - self._level) * 60 / self.rpm:.3f}s",
+                }
+                if limited:
+                    headers['retry-after-ms'] = str(int(wait * 1000) + 1)
+                    self.rejected['limit'] += 1
+                    return headers, 'limit'
+            if self.error_rate and self._random.random() < self.error_rate:
+                headers['retry-after-ms'] = '200'
+                self.rejected['injected'] += 1
+                return headers, 'injected'
+            return headers, None
+
+    def stalls(self):
+        with self._lock:
+            return bool(self.stall_rate) and self._random.random() < self.stall_rate
+
+def _message(mock, thread_id, text, role="assistant", status="completed"):
+    return {
+        "id": mock.next_id("msg"), "object": "thread.message", "created_at": int(time.time()),
+        "thread_id": thread_id, "role": role, "status": status, "assistant_id": None, "run_id": None,
+        "attachments": [], "metadata": {},
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}] if text is not None else [],
+    }
+
+def _run(mock, thread_id, assistant_id, status, usage=None):
+    return {
+        "id": mock.next_id("run"), "object": "thread.run", "created_at": int(time.time()),
+        "thread_id": thread_id, "assistant_id": assistant_id, "status": status,
+        "instructions": "", "model": "mock", "tools": [], "metadata": {}, "usage": usage,
+    }
+
+def _make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _send_headers(self):
+            for name, value in self.limit_headers.items():
+                self.send_header(name, value)
+
+        def _json(self, payload, status=200):
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            if status == 200 and mock.stalls():
+                time.sleep(mock.stall)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self._send_headers()
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _sse(self, events):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self._send_headers()
+            self.end_headers()
+            self.close_connection = True
+            stall = mock.stalls()
+            for i, (event, data) in enumerate(events):
+                if stall and i == 1:
+                    time.sleep(mock.stall)
+                chunk = ""
+                if event:
+                    chunk += f"event: {event}\n"
+                chunk += f"data: {data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n"
+                self.wfile.write(chunk.encode('utf-8'))
+                self.wfile.flush()
+
+        def _chunks(self, text):
+            for i in range(0, len(text), mock.chunk_size):
+                if mock.chunk_delay:
+                    time.sleep(mock.chunk_delay)
+                yield text[i:i + mock.chunk_size]
+
+        def do_POST(self):
+            body = self._body()
+            path = self.path.split('?')[0]
+            if mock.latency:
+                time.sleep(mock.latency)
+            self.limit_headers, rejected = mock.admit()
+            if rejected:
+                mock.count('rate_limited')
+                return self._json({"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                             "code": "rate_limit_exceeded"}}, status=429)
+
+            if path.endswith('/chat/completions'):
+                mock.count('chat.completions')
+                return self._chat(body)
+            if path.endswith('/threads'):
+                mock.count('threads.create')
+                return self._json({"id": mock.next_id("thread"), "object": "thread",
+                                   "created_at": int(time.time()), "metadata": {}})
+            match = re.search(r'/threads/([^/]+)/(messages|runs)$', path)
+            if match and match.group(2) == 'messages':
+                mock.count('threads.messages.create')
+                mock.threads[match.group(1)].append(body.get('content', ''))
+                return self._json(_message(mock, match.group(1), body.get('content', ''), role="user"))
+            if match and match.group(2) == 'runs':
+                mock.count('threads.runs.stream')
+                return self._run_stream(match.group(1), body)
+            self._json({"error": {"message": f"ruta no soportada: {path}"}}, status=404)
+
+        def _chat(self, body):
+            text = mock.reply(body)
+            usage = {"prompt_tokens": len(json.dumps(body.get('messages', []))) // 4,
+                     "completion_tokens": len(text) // 4}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            if not body.get('stream'):
+                return self._json({
+                    "id": mock.next_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get('model', 'mock'), "usage": usage,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                })
+            completion_id = mock.next_id("chatcmpl")
+
+            def events():
+                for piece in self._chunks(text):
+                    yield None, {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": body.get('model', 'mock'),
+                                 "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                yield None, {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": body.get('model', 'mock'), "usage": usage,
+                             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield None, "[DONE]"
+            self._sse(events())
+
+        def _run_stream(self, thread_id, body):
+            messages = mock.threads[thread_id]
+            messages += [m.get('content', '') for m in body.get('additional_messages') or [] if m.get('role') == 'user']
+            text = mock.reply({**body, 'thread_messages': list(messages)})
+            assistant_id = body.get('assistant_id')
+
+            def events():
+                yield "thread.run.created", _run(mock, thread_id, assistant_id, "queued")
+                message = _message(mock, thread_id, None, status="in_progress")
+                yield "thread.message.created", message
+                for piece in self._chunks(text):
+                    yield "thread.message.delta", {
+                        "id": message["id"], "object": "thread.message.delta",
+                        "delta": {"content": [{"index": 0, "type": "text", "text": {"value": piece}}]},
+                    }
+                message.update(status="completed",
+                               content=[{"type": "text", "text": {"value": text, "annotations": []}}])
+                yield "thread.message.completed", message
+                usage = {"prompt_tokens": len(json.dumps(body)) // 4, "completion_tokens": len(text) // 4}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                yield "thread.run.completed", _run(mock, thread_id, assistant_id, "completed", usage)
+                yield "done", "[DONE]"
+            self._sse(events())
+
+    return Handler
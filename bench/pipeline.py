@@ -0,0 +1,218 @@
+"""Benchmark del flujo de la app (subir -> procesar -> exportar) sin llamar a OpenAI.
+
+    python -m bench.pipeline --invoices 200 --workers 4 --latency 0.3 --malformed 0.2
+
+Genera un corpus de facturas PDF (bench/invoice_corpus.py), las encola como lo hace
+app.py, las procesan workers reales (worker.py) contra el servidor mock, y la
+"sesión" arma el ProductStore y la exportación incremental igual que la app. Reporta
+facturas por segundo, latencia p50/p95 por factura (procesamiento, y total contando
+la espera en la cola), memoria pico, tiempo de exportación y de armado del DataFrame.
+
+Cada corrida se agrega a bench/results.jsonl. Si hay una corrida anterior con los
+mismos parámetros se compara contra ella; con --check el comando termina con error
+si algo empeoró más que --tolerance (para usarlo antes de mergear).
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from bench.backends import percentile
+from bench.invoice_corpus import invoice_reply, make_corpus
+from bench.mock_openai import MockOpenAI
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'results.jsonl')
+PARAMS = ('invoices', 'workers', 'backend', 'latency', 'malformed', 'seed')
+# Métrica -> True si más alto es mejor
+TRACKED = {
+    'invoices_per_s': True,
+    'p95_s': False,
+    'p95_total_s': False,
+    'export_s': False,
+    'frame_s': False,
+    'peak_rss_mb': False,
+    'workers_peak_rss_mb': False,
+}
+
+def _peak_rss_mb(who):
+    if resource is None:
+        return None
+    kb = resource.getrusage(who).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return kb / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args, tmp):
+    # Antes de importar los módulos de la app: cada uno lee su ruta del entorno
+    os.environ.update({
+        'OPENAI_API_KEY': 'mock',
+        'DASSA_CACHE_PATH': os.path.join(tmp, 'invoice_cache.sqlite3'),
+        'DASSA_INDEX_PATH': os.path.join(tmp, 'invoice_index.sqlite3'),
+        'DASSA_METRICS_PATH': os.path.join(tmp, 'metrics.jsonl'),
+        'DASSA_OCR_CACHE_PATH': os.path.join(tmp, 'ocr_cache.sqlite3'),
+    })
+    from assistant_backend import cache_version
+    from export import IncrementalExporter, invoice_to_products
+    from invoice_cache import InvoiceCache
+    from invoice_index import InvoiceIndex
+    from job_queue import JobQueue
+    from product_store import ProductStore
+    from worker import start_workers
+
+    corpus = make_corpus(args.invoices, seed=args.seed)
+    corpus_mb = sum(len(data) for _, data in corpus) / 1e6
+    queue_path = os.path.join(tmp, 'jobs.sqlite3')
+    with MockOpenAI(latency=args.latency, reply=invoice_reply(args.malformed)) as mock:
+        os.environ['OPENAI_BASE_URL'] = mock.base_url
+        queue = JobQueue(queue_path)
+        # Como en app.py: la app crea la cola y el índice antes de levantar los workers
+        InvoiceIndex()
+        processes = start_workers(args.workers, queue_path)
+        store, exporter = ProductStore(), IncrementalExporter()
+        try:
+            start = time.perf_counter()
+            pending = [queue.enqueue(name, data, args.backend, InvoiceCache.make_key(data, cache_version(args.backend)))
+                       for name, data in corpus]
+            failed = duplicates = 0
+            while pending:
+                time.sleep(0.05)
+                jobs = queue.get(pending)
+                pending = [job.id for job in jobs if not job.done]
+                for job in jobs:
+                    if not job.done:
+                        continue
+                    if job.invoice_dict:
+                        store.add_invoice(job.invoice_dict)
+                        exporter.append(invoice_to_products(job.invoice_dict))
+                    elif job.status == 'duplicate':
+                        duplicates += 1
+                    else:
+                        failed += 1
+            elapsed = time.perf_counter() - start
+
+            t0 = time.perf_counter()
+            excel = exporter.excel_bytes()
+            exporter.csv_bytes()
+            export_s = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            store.to_frame()
+            frame_s = time.perf_counter() - t0
+        finally:
+            exporter.discard()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+        requests = mock.requests
+
+    with sqlite3.connect(queue_path) as conn:
+        rows = conn.execute("SELECT finished_at - started_at, finished_at - created_at FROM jobs WHERE status = 'done'").fetchall()
+    latencies, totals = [row[0] for row in rows], [row[1] for row in rows]
+    with open(os.environ['DASSA_METRICS_PATH'], encoding='utf-8') as f:
+        lenient = sum(1 for line in f if '"path": "lenient"' in line)
+    return {
+        'invoices_per_s': args.invoices / elapsed,
+        'p50_s': percentile(latencies, 50) if latencies else None,
+        'p95_s': percentile(latencies, 95) if latencies else None,
+        'p95_total_s': percentile(totals, 95) if totals else None,
+        'export_s': export_s,
+        'frame_s': frame_s,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+        'workers_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        'rows': exporter.rows,
+        'excel_mb': len(excel) / 1e6,
+        'corpus_mb': corpus_mb,
+        'failed': failed,
+        'duplicates': duplicates,
+        'json_repaired': lenient,
+        'requests': requests,
+    }
+
+def load_previous(path, params):
+    previous = None
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['params'] == params:
+                    previous = entry
+    except FileNotFoundError:
+        pass
+    return previous
+
+def compare(result, previous, tolerance):
+    """Lista de (métrica, antes, ahora, empeoró)."""
+    rows = []
+    for metric, higher_is_better in TRACKED.items():
+        before, now = previous['result'].get(metric), result.get(metric)
+        if not before or now is None:
+            continue
+        change = (now - before) / before
+        worse = change < -tolerance if higher_is_better else change > tolerance
+        rows.append((metric, before, now, worse))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--backend', default='structured')
+    parser.add_argument('--latency', type=float, default=0.2, help="latencia simulada por request (s)")
+    parser.add_argument('--malformed', type=float, default=0.2, help="fracción de respuestas mal formadas")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.15, help="empeoramiento aceptado (0.15 = 15%%)")
+    parser.add_argument('--check', action='store_true', help="terminar con error si hay una regresión")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    params = {name: getattr(args, name) for name in PARAMS}
+    with tempfile.TemporaryDirectory(prefix='dassa_bench_') as tmp:
+        result = run(args, tmp)
+
+    print(f"{args.invoices} facturas ({result['corpus_mb']:.1f} MB de PDF), {args.workers} workers, "
+          f"backend {args.backend}, latencia {args.latency}s, {args.malformed:.0%} mal formadas")
+    print(f"  facturas/s          {result['invoices_per_s']:.2f}")
+    if result['p95_s'] is not None:
+        print(f"  latencia p50 / p95  {result['p50_s']:.2f} s / {result['p95_s']:.2f} s "
+              f"(con la espera en la cola, p95 {result['p95_total_s']:.2f} s)")
+    print(f"  exportación         {result['export_s']:.3f} s ({result['rows']} filas, {result['excel_mb']:.2f} MB de Excel)")
+    print(f"  DataFrame           {result['frame_s']:.3f} s")
+    if result['peak_rss_mb'] is not None:
+        print(f"  memoria pico        app {result['peak_rss_mb']:.0f} MB · worker {result['workers_peak_rss_mb']:.0f} MB")
+    print(f"  requests al mock    {result['requests']} · JSON reparados {result['json_repaired']} · "
+          f"fallidas {result['failed']} · duplicadas {result['duplicates']}")
+
+    previous = load_previous(args.results, params)
+    regressions = []
+    if previous:
+        print(f"Comparado con {previous.get('commit') or '?'} ({previous['date']}):")
+        for metric, before, now, worse in compare(result, previous, args.tolerance):
+            print(f"  {metric:<20}{before:>10.3f} -> {now:>10.3f}{'  <-- REGRESIÓN' if worse else ''}")
+            if worse:
+                regressions.append(metric)
+    if not args.no_save:
+        entry = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': _git_commit(), 'params': params, 'result': result}
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+    if result['failed']:
+        print(f"{result['failed']} facturas no se pudieron leer")
+    return 1 if args.check and (regressions or result['failed']) else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
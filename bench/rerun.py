@@ -0,0 +1,63 @@
+"""Mide cuánto tarda un rerun de la app a medida que la sesión acumula mensajes.
+
+    python -m bench.rerun --app app.py --messages 100 --step 20
+
+Se corre desde la raíz del repo (la app lee logo.png y avatar.png de ahí). El chat va
+contra el servidor mock y los cachés, la cola y las métricas quedan en un directorio
+temporal.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from bench.mock_openai import MockOpenAI
+
+def history_length(at):
+    # app.py guarda el historial en 'messages' y app2.py en 'chat_history'
+    for key in ('messages', 'chat_history'):
+        if key in at.session_state:
+            return len(at.session_state[key])
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default='app.py')
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--step', type=int, default=20, help="cada cuántos mensajes se mide")
+    parser.add_argument('--repeat', type=int, default=5, help="reruns por medición")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, MockOpenAI(reply=lambda body: "Respuesta de prueba. " * 20) as mock:
+        os.environ.update({
+            'OPENAI_API_KEY': 'mock',
+            'OPENAI_BASE_URL': mock.base_url,
+            'DASSA_EXTERNAL_WORKERS': '1',
+            'DASSA_CACHE_PATH': os.path.join(tmp, 'invoice_cache.sqlite3'),
+            'DASSA_QUEUE_PATH': os.path.join(tmp, 'jobs.sqlite3'),
+            'DASSA_METRICS_PATH': os.path.join(tmp, 'metrics.jsonl'),
+            'DASSA_FAQ_PATH': os.path.join(tmp, 'faq_cache.sqlite3'),
+        })
+        from streamlit.testing.v1 import AppTest
+
+        start = time.perf_counter()
+        at = AppTest.from_file(os.path.abspath(args.app), default_timeout=60).run()
+        print(f"Primera ejecución: {1000 * (time.perf_counter() - start):.0f} ms")
+        print(f"{'mensajes':>9}{'rerun p50 (ms)':>16}{'rerun máx (ms)':>16}")
+        for sent in range(args.messages + 1):
+            if sent:
+                at.chat_input[0].set_value(f"Consulta {sent} sobre el contenedor MSCU{sent:07d}").run()
+            if at.exception:
+                raise SystemExit(at.exception[0].message)
+            if sent % args.step:
+                continue
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                at.run()
+                times.append(1000 * (time.perf_counter() - t0))
+            print(f"{history_length(at):>9}{statistics.median(times):>16.1f}{max(times):>16.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Reintentos, límite de requests y hedging (rate_limit.py) contra una API que falla.
+
+    python -m bench.resilience --invoices 200 --concurrency 8 --rpm 300 --error-rate 0.05 --stall-rate 0.05
+
+Extrae facturas en paralelo (modo 'structured') contra el servidor mock:
+- con un límite de requests por minuto más bajo que el que supone el Scheduler y 429
+  al azar, sin Scheduler (como antes: sin reintentos) y con él;
+- con respuestas que se cuelgan, con y sin hedging.
+Después manda mensajes al chat con streams que se cuelgan, para ver que cortan a
+tiempo en lugar de quedar esperando.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.backends import percentile
+from bench.invoice_corpus import invoice_reply, invoice_text
+from bench.mock_openai import MockOpenAI
+
+# (título, opciones del mock, [(configuración, opciones del Scheduler)]). Sin opciones
+# es como antes: un cliente sin límite de requests ni reintentos
+SECTIONS = (
+    ("Límite de requests y 429 al azar", lambda a: {'rpm': a.rpm, 'error_rate': a.error_rate},
+     [('sin scheduler', None), ('scheduler', {})]),
+    # Con límites holgados, para que la cola del Scheduler no tape la latencia de la API
+    ("Respuestas colgadas", lambda a: {'rpm': 6000, 'stall_rate': a.stall_rate, 'stall': a.stall},
+     [('scheduler', {'tokens_per_minute': 10 ** 7}),
+      ('scheduler + hedging', {'tokens_per_minute': 10 ** 7, 'hedge': True})]),
+)
+
+def extract_all(client, texts, concurrency):
+    from assistant_backend import process_invoice_remote
+
+    def one(text):
+        start = time.perf_counter()
+        try:
+            process_invoice_remote(client, text, 'structured')
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, type(e).__name__
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, texts))
+
+def chat_turns(client, turns):
+    from assistant_backend import ChatSession, stream_chat_reply
+    results = []
+    for i in range(turns):
+        start = time.perf_counter()
+        try:
+            "".join(stream_chat_reply(client, f"¿Dónde está el contenedor MSCU{i:07d}?", ChatSession()))
+            results.append((time.perf_counter() - start, None))
+        except Exception as e:
+            results.append((time.perf_counter() - start, type(e).__name__))
+    return results
+
+def report(label, results, elapsed=None):
+    times = [seconds for seconds, error in results if error is None]
+    errors = {}
+    for _, error in results:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    line = f"  {label:<22}{len(times):>4}/{len(results):<4}"
+    if elapsed:
+        line += f"{len(times) / elapsed:>8.1f}/s"
+    if times:
+        line += (f"  p50 {percentile(times, 50):5.2f}  p95 {percentile(times, 95):5.2f}"
+                 f"  p99 {percentile(times, 99):5.2f}  máx {max(seconds for seconds, _ in results):5.2f} s")
+    if errors:
+        line += "  errores: " + ", ".join(f"{name} x{count}" for name, count in sorted(errors.items()))
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.1, help="latencia simulada por request (s)")
+    parser.add_argument('--rpm', type=int, default=300, help="límite de requests por minuto del mock")
+    parser.add_argument('--error-rate', type=float, default=0.05, help="fracción de 429 al azar")
+    parser.add_argument('--stall-rate', type=float, default=0.05, help="fracción de respuestas colgadas")
+    parser.add_argument('--stall', type=float, default=5.0, help="segundos que se cuelga una respuesta")
+    parser.add_argument('--idle-timeout', type=float, default=2.0, help="corte de streams sin datos (s)")
+    parser.add_argument('--chat-turns', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='dassa_bench_') as tmp:
+        os.environ['DASSA_METRICS_PATH'] = os.path.join(tmp, 'metrics.jsonl')
+        import assistant_backend
+        import rate_limit
+        from openai import OpenAI
+
+        from assistant_backend import make_client
+        assistant_backend.STREAM_IDLE_TIMEOUT = args.idle_timeout
+
+        texts = ["\n".join(line for page in invoice_text(i, 5 + i % 40) for line in page) for i in range(args.invoices)]
+        print(f"{args.invoices} facturas, {args.concurrency} en paralelo, latencia {args.latency}s")
+        for title, mock_options, scenarios in SECTIONS:
+            options = mock_options(args)
+            print(f"{title}: " + ", ".join(f"{name}={value}" for name, value in options.items()))
+            for label, scheduler_options in scenarios:
+                with MockOpenAI(latency=args.latency, reply=invoice_reply(), **options) as mock:
+                    # El Scheduler arranca con DASSA_RPM y aprende el límite real de los encabezados
+                    scheduler = rate_limit.Scheduler(**({'max_retries': 0} if scheduler_options is None else scheduler_options))
+                    rate_limit.set_scheduler(scheduler)
+                    if scheduler_options is None:
+                        client = OpenAI(api_key='mock', base_url=mock.base_url, max_retries=0)
+                    else:
+                        client = make_client('mock', base_url=mock.base_url)
+                    start = time.perf_counter()
+                    results = extract_all(client, texts, args.concurrency)
+                    report(label, results, time.perf_counter() - start)
+                    stats = scheduler.stats()
+                    print(f"  {'':<22}429: {mock.rejected['limit']} por límite, {mock.rejected['injected']} al azar · "
+                          f"reintentos {stats['retries']} · esperas por cupo {stats['throttled']} · "
+                          f"duplicados {stats['hedged']} (ganaron {stats['hedge_wins']})")
+
+        print(f"Chat: {args.chat_turns} mensajes, la mitad de los streams colgados, corte a los {args.idle_timeout:.0f} s")
+        with MockOpenAI(latency=args.latency, stall_rate=0.5, stall=args.stall,
+                        reply=lambda body: "El contenedor está en el depósito. " * 10) as mock:
+            rate_limit.set_scheduler(rate_limit.Scheduler())
+            report('chat', chat_turns(make_client('mock', base_url=mock.base_url), args.chat_turns))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Procesamiento de facturas sin la interfaz de Streamlit.
+
+    python dassa_bot.py process facturas/ -o productos.xlsx
+
+Recorre los PDFs del directorio (y subdirectorios), lee los PDFs en un pool de
+procesos y consulta al modelo en un pool de hilos (ver batch.py), y escribe un solo
+archivo con todos los productos (.xlsx, .csv o .parquet según la extensión).
+
+Cada factura terminada se anota en un checkpoint (por defecto <salida>.checkpoint.jsonl):
+si el proceso se corta, al volver a correr el mismo comando se saltean las facturas que
+ya estaban y el archivo final igual las incluye. Las que dieron error se reintentan.
+Las facturas que ya se habían procesado antes (con otro nombre, en otra corrida o desde
+la app, ver invoice_index.py) no se vuelven a mandar al modelo ni se exportan, salvo con
+--include-duplicates.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import metrics
+from assistant_backend import BACKENDS, DEFAULT_BACKEND, cache_version, check_items, make_client, process_invoice
+from batch import AI_WORKERS, iter_batch
+from export import IncrementalExporter, invoice_to_products
+from invoice_cache import InvoiceCache
+from invoice_index import DuplicateInvoiceError, InvoiceIndex
+from json_repair import parse_json_lenient
+from worker import get_openai_key
+
+# PDFs que se leen a memoria por tanda (el directorio puede tener miles)
+CHUNK_SIZE = 200
+
+def find_pdfs(directory):
+    """Rutas de los PDFs del directorio, relativas a él y en orden."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith('.pdf'):
+                paths.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(paths)
+
+def load_checkpoint(path):
+    """Devuelve {pdf: registro} con lo anotado en el checkpoint (el último registro de cada PDF)."""
+    done = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # última línea a medio escribir
+                done[entry['pdf']] = entry
+    except FileNotFoundError:
+        pass
+    return done
+
+def process_directory(directory, output, backend=DEFAULT_BACKEND, ai_workers=AI_WORKERS, pdf_workers=None,
+                      checkpoint=None, client=None, log=print, include_duplicates=False):
+    """Procesa todos los PDFs de `directory` y escribe la exportación en `output`.
+
+    Devuelve un dict con la cantidad de facturas ok (incluye las del caché), con error,
+    duplicadas, desde el caché y desde el checkpoint. Con `include_duplicates` las
+    facturas ya procesadas antes se exportan igual (y se registran en el índice).
+    """
+    checkpoint = checkpoint or output + '.checkpoint.jsonl'
+    ext = os.path.splitext(output)[1].lower()
+    if ext not in ('.xlsx', '.csv', '.parquet'):
+        raise ValueError(f"Formato de salida desconocido: {ext} (usar .xlsx, .csv o .parquet)")
+    client = client or make_client(get_openai_key())
+    cache = InvoiceCache()
+    index = InvoiceIndex()
+    exporter = IncrementalExporter(parquet=ext == '.parquet')
+    summary = {'ok': 0, 'error': 0, 'duplicate': 0, 'cache': 0, 'checkpoint': 0}
+
+    done = load_checkpoint(checkpoint)
+    paths = find_pdfs(directory)
+    todo = []
+    for path in paths:
+        entry = done.get(path)
+        if entry and entry['status'] in ('ok', 'duplicate'):
+            if entry['status'] == 'ok':
+                exporter.append(invoice_to_products(entry['invoice']))
+            summary['checkpoint'] += 1
+        else:
+            todo.append(path)
+    log(f"{len(paths)} PDFs: {summary['checkpoint']} ya procesados, {len(todo)} pendientes")
+
+    def ref(path):
+        # Ligado al checkpoint: al reanudar la misma corrida la factura no es duplicado de sí misma
+        return f"cli:{os.path.abspath(checkpoint)}:{path}"
+
+    def check_duplicate(invoice_dict, pdf_text, path):
+        """Registra la factura y devuelve la original si ya estaba (None con include_duplicates)."""
+        original = index.register(invoice_dict, pdf_text, path, ref(path))
+        return None if include_duplicates else original
+
+    def process_fn(path, pdf_text):
+        original = None if include_duplicates else index.find_text(pdf_text, exclude_ref=ref(path))
+        if original:
+            raise DuplicateInvoiceError(original)
+        reply = process_invoice(client, pdf_text, backend)
+        with metrics.span('json_parse') as labels:
+            invoice_dict, error = parse_json_lenient(reply, labels)
+        if invoice_dict:
+            error = check_items(invoice_dict, pdf_text)
+            original = check_duplicate(invoice_dict, pdf_text, path)
+            if original:
+                raise DuplicateInvoiceError(original)
+        return invoice_dict, error, reply
+
+    try:
+        with open(checkpoint, 'a', encoding='utf-8') as checkpoint_file:
+            def finish(path, invoice_dict=None, error=None, duplicate=False):
+                if duplicate:
+                    status = 'duplicate'
+                    log(f"{path}: {error}")
+                elif invoice_dict:
+                    status = 'ok'
+                    exporter.append(invoice_to_products(invoice_dict))
+                    if error:
+                        log(f"Revisar {path}: {error}")
+                else:
+                    status = 'error'
+                    log(f"Error en {path}: {error}")
+                summary[status] += 1
+                entry = {'pdf': path, 'status': status, 'invoice': invoice_dict, 'error': error}
+                checkpoint_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                checkpoint_file.flush()
+
+            for start in range(0, len(todo), CHUNK_SIZE):
+                files, keys = [], {}
+                for path in todo[start:start + CHUNK_SIZE]:
+                    with open(os.path.join(directory, path), 'rb') as f:
+                        data = f.read()
+                    keys[path] = InvoiceCache.make_key(data, cache_version(backend))
+                    cached = cache.get(keys[path])
+                    if cached:
+                        original = check_duplicate(cached.invoice_dict, cached.pdf_text, path)
+                        if original:
+                            finish(path, error=f"Factura duplicada: {original.describe()}", duplicate=True)
+                        else:
+                            summary['cache'] += 1
+                            finish(path, cached.invoice_dict)
+                    else:
+                        files.append((path, data))
+                for result in iter_batch(files, process_fn, pdf_workers=pdf_workers, ai_workers=ai_workers):
+                    if isinstance(result.error, DuplicateInvoiceError):
+                        finish(result.name, error=str(result.error), duplicate=True)
+                    elif result.status == 'error':
+                        finish(result.name, error=f"{type(result.error).__name__}: {result.error}")
+                    elif result.status == 'ok':
+                        invoice_dict, error, _ = result.reply
+                        if invoice_dict:
+                            cache.put(keys[result.name], result.pdf_text, invoice_dict)
+                        finish(result.name, invoice_dict, error)
+                log(f"Procesados {min(start + CHUNK_SIZE, len(todo))} de {len(todo)}")
+
+        exporter.close()
+        source = {'.xlsx': exporter.excel_path, '.csv': exporter.csv_path, '.parquet': exporter.parquet_path}[ext]
+        if source is None:
+            raise RuntimeError("No se pudo escribir el Parquet (falta pyarrow o no hay filas)")
+        shutil.copyfile(source, output)
+    finally:
+        exporter.discard()
+    log(f"{exporter.rows} productos escritos en {output}")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='dassa-bot', description="Procesamiento de facturas de DASSA Bot")
+    commands = parser.add_subparsers(dest='command', required=True)
+    process = commands.add_parser('process', help="procesa todos los PDFs de un directorio")
+    process.add_argument('directory')
+    process.add_argument('-o', '--output', required=True, help="archivo de salida (.xlsx, .csv o .parquet)")
+    process.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND)
+    process.add_argument('--workers', type=int, default=AI_WORKERS, help="consultas simultáneas al modelo")
+    process.add_argument('--pdf-workers', type=int, default=None, help="procesos para leer los PDFs")
+    process.add_argument('--checkpoint', default=None)
+    process.add_argument('--include-duplicates', action='store_true',
+                         help="exporta también las facturas que ya se habían procesado antes")
+    args = parser.parse_args(argv)
+
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    summary = process_directory(args.directory, args.output, args.backend, args.workers, args.pdf_workers,
+                                args.checkpoint, log=log, include_duplicates=args.include_duplicates)
+    log(f"OK: {summary['ok']} · desde caché: {summary['cache']} · ya procesadas: {summary['checkpoint']} · "
+        f"duplicadas: {summary['duplicate']} · con error: {summary['error']}")
+    return 1 if summary['error'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Exportación incremental de productos a Excel, CSV y (si está pyarrow) Parquet.
+
+Las filas se escriben a disco a medida que se procesan las facturas: el Excel va en
+modo constant_memory de xlsxwriter y los anchos de columna se calculan sobre la
+marcha, así que al exportar solo queda cerrar los archivos.
+"""
+import csv
+import importlib.util
+import os
+import shutil
+import tempfile
+import weakref
+
+import xlsxwriter
+
+# pyarrow es opcional y pesado de importar: se carga recién al escribir el primer lote
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+EXPORT_COLUMNS = [
+    'Fecha', 'Número de Factura', 'CUIT Emisor', 'Cliente', 'Importe Total Factura', 'IVA',
+    'Descripción', 'Cantidad', 'Precio Unitario', 'Subtotal',
+]
+# Claves que el modelo agregue por fuera del esquema van juntas en esta columna
+EXTRA_COLUMN = 'Otros datos'
+PARQUET_BATCH_ROWS = 5000
+
+def _remove_files(directory, handles):
+    for handle in handles:
+        try:
+            handle.close()
+        except Exception:
+            pass
+    shutil.rmtree(directory, ignore_errors=True)
+
+def invoice_to_products(invoice_dict):
+    """Aplana una factura en filas de producto con la información del encabezado."""
+    header = {
+        'Fecha': invoice_dict.get('Fecha', ''),
+        'Número de Factura': invoice_dict.get('Número de Factura', ''),
+        'CUIT Emisor': invoice_dict.get('CUIT Emisor', ''),
+        'Cliente': invoice_dict.get('Cliente', ''),
+        'Importe Total Factura': invoice_dict.get('Importe Total', ''),
+        'IVA': invoice_dict.get('IVA', ''),
+    }
+    products = []
+    if 'Detalle de Productos' in invoice_dict and isinstance(invoice_dict['Detalle de Productos'], list):
+        for product in invoice_dict['Detalle de Productos']:
+            # Igual que ProductStore.add_invoice: un renglón que no es un objeto no se exporta
+            if not isinstance(product, dict):
+                continue
+            # Añadir información del encabezado a cada producto
+            product_with_header = dict(header)
+            # Añadir detalles del producto
+            product_with_header.update(product)
+            products.append(product_with_header)
+
+    # Si no hay productos específicos, crear una fila con la información general
+    if not products:
+        products = [dict(header, **{
+            'Descripción': 'Información general',
+            'Subtotal': invoice_dict.get('Importe Total', '')
+        })]
+    return products
+
+class IncrementalExporter:
+    """Los archivos quedan en un directorio temporal que se borra con discard(), o cuando
+    el objeto se libera (una sesión de Streamlit que vence) o termina el proceso."""
+
+    def __init__(self, columns=EXPORT_COLUMNS, parquet=True):
+        self.columns = list(columns) + [EXTRA_COLUMN]
+        self.directory = tempfile.mkdtemp(prefix='dassa_export_')
+        self.excel_path = os.path.join(self.directory, 'productos.xlsx')
+        self.csv_path = os.path.join(self.directory, 'productos.csv')
+        self.parquet_path = os.path.join(self.directory, 'productos.parquet') if parquet and HAS_PYARROW else None
+        self.rows = 0
+        self.closed = False
+        self._widths = [len(col) for col in self.columns]
+
+        self._workbook = xlsxwriter.Workbook(self.excel_path, {'constant_memory': True})
+        self._worksheet = self._workbook.add_worksheet('Productos')
+        self._worksheet.write_row(0, 0, self.columns)
+        self._csv_file = open(self.csv_path, 'w', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(self.columns)
+        self._parquet_writer = None
+        self._parquet_buffer = []
+        # Sin referencias a self: si no, el finalizador mantendría vivo al objeto
+        self._handles = [self._csv_file]
+        self._finalizer = weakref.finalize(self, _remove_files, self.directory, self._handles)
+
+    def _to_row(self, product):
+        row = [product.get(col, '') for col in self.columns[:-1]]
+        extra = {k: v for k, v in product.items() if k not in self.columns}
+        row.append('; '.join(f"{k}: {v}" for k, v in extra.items()))
+        return ['' if value is None else str(value) for value in row]
+
+    def append(self, products):
+        if self.closed:
+            raise RuntimeError("La exportación ya fue cerrada")
+        for product in products:
+            row = self._to_row(product)
+            self.rows += 1
+            self._worksheet.write_row(self.rows, 0, row)
+            self._csv.writerow(row)
+            for idx, value in enumerate(row):
+                if len(value) > self._widths[idx]:
+                    self._widths[idx] = len(value)
+            if self.parquet_path:
+                self._parquet_buffer.append(row)
+                if len(self._parquet_buffer) >= PARQUET_BATCH_ROWS:
+                    self._flush_parquet()
+
+    def _flush_parquet(self):
+        if not self._parquet_buffer:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns = list(zip(*self._parquet_buffer))
+        table = pa.table({name: list(values) for name, values in zip(self.columns, columns)})
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.parquet_path, table.schema)
+            self._handles.append(self._parquet_writer)
+        self._parquet_writer.write_table(table)
+        self._parquet_buffer = []
+
+    def close(self):
+        """Cierra los archivos; se puede llamar más de una vez."""
+        if self.closed:
+            return
+        self.closed = True
+        for idx, width in enumerate(self._widths):
+            self._worksheet.set_column(idx, idx, width + 2)
+        self._workbook.close()
+        self._csv_file.close()
+        if self.parquet_path:
+            self._flush_parquet()
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+            else:
+                self.parquet_path = None
+
+    def excel_bytes(self):
+        self.close()
+        with open(self.excel_path, 'rb') as f:
+            return f.read()
+
+    def csv_bytes(self):
+        self.close()
+        with open(self.csv_path, 'rb') as f:
+            return f.read()
+
+    def parquet_bytes(self):
+        self.close()
+        if not self.parquet_path:
+            return None
+        with open(self.parquet_path, 'rb') as f:
+            return f.read()
+
+    def discard(self):
+        if not self.closed:
+            self.closed = True
+            self._workbook.close()
+            self._csv_file.close()
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+        self._finalizer()
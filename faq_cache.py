@@ -0,0 +1,217 @@
+"""Caché de respuestas a las preguntas frecuentes del chat.
+
+Antes de hacer un run del asistente se busca la pregunta entre las ya respondidas:
+primero por el texto normalizado (minúsculas, sin acentos ni signos) y después por
+parecido, con un índice TF-IDF de palabras y trigramas de letras que se recorre con
+NumPy. Las respuestas vencen a las `ttl_hours` y se pueden borrar a mano.
+
+Solo se guardan preguntas generales: las que tienen números (contenedores, CUIT,
+montos, fechas) son de un cliente en particular y no se guardan ni se buscan. Y el
+parecido no alcanza: una pregunta parecida tiene que tener las mismas palabras con
+contenido (salvo plurales y errores de tipeo), así "horario de atención" no se
+responde con lo guardado para "horario de atención los sábados".
+
+    respuesta = faq.get(pregunta)   # None si no hay ninguna parecida
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+DEFAULT_PATH = os.getenv('DASSA_FAQ_PATH', os.path.join('.cache', 'faq_cache.sqlite3'))
+# Similitud coseno mínima para dar por buena una pregunta parecida
+MIN_SIMILARITY = 0.75
+_STOPWORDS = set("""
+a al como con de del el en es esta este hay la las le lo los me mi para por que se su sus un una unos y o
+hola buenas buenos dias tardes noches gracias porfa favor quisiera queria quiero saber necesito podrias
+""".split())
+
+def normalize_question(text):
+    """'¿Cuál es el HORARIO?' -> 'cual es el horario'"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'\w+', text))
+
+def is_specific(normalized):
+    """True si la pregunta menciona números o códigos (MSCU1234567, 20-12345678-6, 1.331,00)."""
+    return any(c.isdigit() for c in normalized)
+
+def _content_words(normalized):
+    # Sin plural, para que 'contenedores' y 'contenedor' cuenten como la misma palabra
+    return {re.sub(r'(es|s)$', '', word) if len(word) > 4 else word
+            for word in normalized.split() if word not in _STOPWORDS}
+
+def _close(a, b):
+    """Misma palabra, o un error de tipeo (una letra de más, de menos o cambiada) en palabras largas."""
+    if a == b:
+        return True
+    if min(len(a), len(b)) < 5 or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i in range(len(b)):
+        if a[:i] == b[:i]:
+            if a[i:] == b[i + 1:] or (len(a) == len(b) and a[i + 1:] == b[i + 1:]):
+                return True
+    return False
+
+def same_content(query, stored):
+    """Cada palabra con contenido de una pregunta tiene su par en la otra."""
+    a, b = _content_words(query), _content_words(stored)
+    return all(any(_close(w, v) for v in b) for w in a) and all(any(_close(w, v) for v in a) for w in b)
+
+def _features(normalized):
+    # Palabras con contenido más sus trigramas de letras (toleran errores de tipeo y plurales)
+    features = Counter()
+    for word in normalized.split():
+        if word in _STOPWORDS:
+            continue
+        features['w:' + word] += 1
+        padded = f' {word} '
+        for i in range(len(padded) - 2):
+            features[padded[i:i + 3]] += 1
+    return features
+
+class FAQCache:
+    def __init__(self, path=DEFAULT_PATH, version='', ttl_hours=7 * 24, min_similarity=MIN_SIMILARITY):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.version = version
+        self.ttl = ttl_hours * 3600
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                question_norm TEXT NOT NULL,
+                version TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (question_norm, version)
+            );
+        """)
+        self._conn.commit()
+        self._stats = Counter()
+        self._index = None  # se arma de nuevo cuando cambian las respuestas guardadas
+
+    def get(self, question):
+        """Respuesta guardada para la pregunta o una muy parecida; None si no hay."""
+        normalized = normalize_question(question)
+        if not normalized or is_specific(normalized):
+            return None
+        with self._lock:
+            now = time.time()
+            row = self._conn.execute(
+                "SELECT answer, created_at FROM answers WHERE question_norm = ? AND version = ?",
+                (normalized, self.version),
+            ).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._hit(normalized, 'exact')
+                return row[0]
+            match = self._search(normalized, now)
+            if match is None:
+                self._stats['misses'] += 1
+                return None
+            self._hit(match[0], 'similar')
+            return match[1]
+
+    def put(self, question, answer):
+        normalized = normalize_question(question)
+        if not normalized or not answer or is_specific(normalized):
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (question_norm, version, question, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                (normalized, self.version, question, answer, time.time()),
+            )
+            self._conn.commit()
+            self._index = None
+
+    def invalidate(self, question=None):
+        """Borra la respuesta a una pregunta, o todas si no se indica ninguna."""
+        with self._lock:
+            if question is None:
+                self._conn.execute("DELETE FROM answers")
+            else:
+                self._conn.execute("DELETE FROM answers WHERE question_norm = ?", (normalize_question(question),))
+            self._conn.commit()
+            self._index = None
+
+    def entries(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT question, answer, created_at, hits FROM answers WHERE version = ? ORDER BY hits DESC",
+                (self.version,),
+            ).fetchall()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers WHERE version = ?", (self.version,)).fetchone()[0]
+        return {'exact': self._stats['exact'], 'similar': self._stats['similar'], 'misses': self._stats['misses'], 'entries': entries}
+
+    def _hit(self, normalized, kind):
+        self._stats[kind] += 1
+        self._conn.execute(
+            "UPDATE answers SET hits = hits + 1 WHERE question_norm = ? AND version = ?", (normalized, self.version)
+        )
+        self._conn.commit()
+
+    def _build_index(self, now):
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT question_norm, answer, created_at FROM answers WHERE version = ?", (self.version,)
+        ).fetchall()
+        docs = [_features(row[0]) for row in rows]
+        doc_freq = Counter(feature for doc in docs for feature in doc)
+        idf = {feature: math.log((1 + len(docs)) / (1 + df)) + 1 for feature, df in doc_freq.items()}
+        # Índice invertido: feature -> (filas, pesos ya normalizados)
+        postings = defaultdict(lambda: ([], []))
+        for row_idx, doc in enumerate(docs):
+            weights = {feature: count * idf[feature] for feature, count in doc.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for feature, w in weights.items():
+                postings[feature][0].append(row_idx)
+                postings[feature][1].append(w / norm)
+        import numpy as np
+        self._index = {
+            'rows': rows,
+            'idf': idf,
+            'postings': {f: (np.array(r, dtype=np.int32), np.array(w)) for f, (r, w) in postings.items()},
+        }
+
+    def _search(self, normalized, now):
+        if self._index is None:
+            self._build_index(now)
+        rows = self._index['rows']
+        if not rows:
+            return None
+        idf = self._index['idf']
+        query = {f: count * idf[f] for f, count in _features(normalized).items() if f in idf}
+        norm = math.sqrt(sum(w * w for w in _weights_with_unknown(normalized, idf)))
+        if not query or not norm:
+            return None
+        import numpy as np
+        scores = np.zeros(len(rows))
+        for feature, w in query.items():
+            row_ids, weights = self._index['postings'][feature]
+            scores[row_ids] += weights * (w / norm)
+        # De la más parecida a la menos, la primera que además tiene las mismas palabras
+        for best in np.argsort(-scores):
+            if scores[best] < self.min_similarity:
+                break
+            if now - rows[best][2] <= self.ttl and same_content(normalized, rows[best][0]):
+                return rows[best][0], rows[best][1]
+        return None
+
+def _weights_with_unknown(normalized, idf):
+    # Las features que no están en el índice igual cuentan para la norma de la consulta
+    # (con el idf máximo), si no una pregunta larga y distinta podría parecer igual
+    default = max(idf.values(), default=1.0)
+    return [count * idf.get(f, default) for f, count in _features(normalized).items()]
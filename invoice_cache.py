@@ -0,0 +1,135 @@
+"""Caché persistente de facturas procesadas, indexada por el hash del PDF.
+
+Guarda el texto extraído y el JSON ya parseado, así un PDF que se vuelve a subir
+no pasa ni por PyPDF2 ni por el asistente.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+DEFAULT_PATH = os.getenv('DASSA_CACHE_PATH', os.path.join('.cache', 'invoice_cache.sqlite3'))
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CachedInvoice:
+    pdf_text: str
+    invoice_dict: dict
+
+class InvoiceCache:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=200 * 1024 * 1024, max_age_days=90):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        # Una sola conexión compartida entre las sesiones de Streamlit, protegida por el lock.
+        # Los workers abren la misma base desde otros procesos: WAL y espera larga por el lock
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS invoices (
+                key TEXT PRIMARY KEY,
+                pdf_text TEXT NOT NULL,
+                invoice_json TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS invoices_last_used ON invoices(last_used);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(pdf_bytes, version):
+        """Clave del caché: hash del PDF más la versión del prompt/asistente."""
+        h = hashlib.sha256(pdf_bytes)
+        h.update(b'\0' + version.encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pdf_text, invoice_json, created_at FROM invoices WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row and now - row[2] > self.max_age:
+                self._conn.execute("DELETE FROM invoices WHERE key = ?", (key,))
+                self._bump('evictions')
+                row = None
+            if row is None:
+                self._bump('misses')
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE invoices SET last_used = ? WHERE key = ?", (now, key))
+            self._bump('hits')
+            self._conn.commit()
+        return CachedInvoice(row[0], json.loads(row[1]))
+
+    def put(self, key, pdf_text, invoice_dict):
+        """Guarda la factura; devuelve False si no se pudo escribir (la factura ya está procesada igual)."""
+        invoice_json = json.dumps(invoice_dict, ensure_ascii=False)
+        size = len(pdf_text.encode('utf-8')) + len(invoice_json.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, pdf_text, invoice_json, size, now, now),
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                logger.warning("No se pudo guardar la factura en el caché: %s", e)
+                return False
+        return True
+
+    def _evict(self, now):
+        # Primero lo vencido, después lo menos usado hasta quedar debajo del tamaño máximo
+        evicted = self._conn.execute(
+            "DELETE FROM invoices WHERE created_at < ?", (now - self.max_age,)
+        ).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM invoices").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM invoices ORDER BY last_used"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM invoices WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        if evicted:
+            self._bump('evictions', evicted)
+
+    def _bump(self, name, amount=1):
+        self._conn.execute(
+            "INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, amount, amount),
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM invoices"
+            ).fetchone()
+        return {
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+            'evictions': stats.get('evictions', 0),
+            'entries': entries,
+            'bytes': total,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM invoices")
+            self._conn.commit()
@@ -0,0 +1,162 @@
+"""Índice persistente de facturas ya procesadas, para no procesar ni exportar dos veces la misma.
+
+Una factura se identifica por el CUIT del emisor y el número de comprobante
+normalizados, y además por una huella del texto extraído. Se consulta dos veces:
+
+- apenas se extrae el texto (find_text): por huella, o por CUIT y número si se pueden
+  leer del texto; si ya estaba, no se llama al modelo.
+- después de parsear la respuesta (register): por CUIT y número del JSON. Si no estaba,
+  queda registrada en la misma transacción, así dos workers no la cuentan dos veces.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from afip_parser import parse_afip_header
+
+DEFAULT_PATH = os.getenv('DASSA_INDEX_PATH', os.path.join('.cache', 'invoice_index.sqlite3'))
+# Las copias de una misma factura solo difieren en esta leyenda
+_COPY_RE = re.compile(r'\b(?:original|duplicado|triplicado|cuadruplicado)\b')
+
+@dataclass
+class IndexedInvoice:
+    cuit: str
+    number: str
+    source: str  # nombre del archivo con el que se procesó
+    ref: str  # quién la registró (trabajo de la cola, archivo del CLI)
+    created_at: float
+
+    def describe(self):
+        when = time.strftime('%d/%m/%Y %H:%M', time.localtime(self.created_at))
+        return f"{self.number or 's/n'} de CUIT {self.cuit or '?'}, procesada como {self.source} el {when}"
+
+class DuplicateInvoiceError(Exception):
+    def __init__(self, original):
+        super().__init__(f"Factura duplicada: {original.describe()}")
+        self.original = original
+
+def normalize_cuit(value):
+    digits = re.sub(r'\D', '', str(value or ''))
+    return digits if len(digits) == 11 else ''
+
+def normalize_number(value):
+    """'A 0003-00001234', '3-1234' y '0000300001234' -> '00003-00001234'."""
+    groups = re.findall(r'\d+', str(value or ''))
+    if len(groups) >= 2:
+        point, number = groups[-2], groups[-1]
+    elif groups and len(groups[0]) > 8:
+        point, number = groups[0][:-8], groups[0][-8:]
+    elif groups:
+        return str(int(groups[0]))
+    else:
+        return ''
+    return f'{int(point):05d}-{int(number):08d}'
+
+def text_fingerprint(pdf_text):
+    text = ' '.join(_COPY_RE.sub('', pdf_text.lower()).split())
+    return hashlib.sha1(text.encode('utf-8')).hexdigest() if text else ''
+
+class InvoiceIndex:
+    def __init__(self, path=DEFAULT_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        # La usan la app y los workers a la vez: WAL y transacciones abiertas a mano
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS invoices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cuit TEXT NOT NULL,
+                number TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                source TEXT NOT NULL,
+                ref TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS invoices_key ON invoices(cuit, number);
+            CREATE INDEX IF NOT EXISTS invoices_fingerprint ON invoices(fingerprint);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+
+    def _find(self, cuit, number, fingerprint, exclude_ref):
+        conditions, params = [], []
+        if fingerprint:
+            conditions.append("fingerprint = ?")
+            params.append(fingerprint)
+        if cuit and number:
+            conditions.append("(cuit = ? AND number = ?)")
+            params += [cuit, number]
+        if not conditions:
+            return None
+        query = f"SELECT cuit, number, source, ref, created_at FROM invoices WHERE ({' OR '.join(conditions)})"
+        if exclude_ref:
+            # Un reintento del mismo trabajo no es un duplicado de sí mismo
+            query += " AND ref != ?"
+            params.append(exclude_ref)
+        row = self._conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+        return IndexedInvoice(*row) if row else None
+
+    def find_text(self, pdf_text, exclude_ref=None):
+        """Factura ya registrada con el mismo texto (o el mismo CUIT y número leídos del texto)."""
+        cuit, number = parse_afip_header(pdf_text) or ('', '')
+        with self._lock:
+            original = self._find(cuit, number, text_fingerprint(pdf_text), exclude_ref)
+            if original:
+                self._bump('duplicates')
+        return original
+
+    def register(self, invoice_dict, pdf_text, source, ref=None):
+        """Registra la factura; si ya estaba (registrada por otro `ref`) devuelve la original."""
+        cuit = normalize_cuit(invoice_dict.get('CUIT Emisor'))
+        number = normalize_number(invoice_dict.get('Número de Factura'))
+        fingerprint = text_fingerprint(pdf_text or '')
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                original = self._find(cuit, number, fingerprint, ref)
+                if original:
+                    self._bump('duplicates')
+                else:
+                    self._conn.execute(
+                        "INSERT INTO invoices (cuit, number, fingerprint, source, ref, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (cuit, number, fingerprint, source, ref or '', time.time()),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return original
+
+    def check(self, invoice_dict, pdf_text, source, ref=None):
+        """Igual que register, pero lanza DuplicateInvoiceError si la factura ya estaba."""
+        original = self.register(invoice_dict, pdf_text, source, ref)
+        if original:
+            raise DuplicateInvoiceError(original)
+
+    def _bump(self, name, amount=1):
+        self._conn.execute(
+            "INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, amount, amount),
+        )
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+        return {'entries': entries, 'duplicates': stats.get('duplicates', 0)}
+
+    def forget(self, cuit, number):
+        """Saca una factura del índice, para poder procesarla de nuevo. Devuelve cuántos registros borró."""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM invoices WHERE cuit = ? AND number = ?", (normalize_cuit(cuit), normalize_number(number))
+            ).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM invoices")
@@ -0,0 +1,157 @@
+"""Cola de trabajos en SQLite para procesar facturas fuera del script de Streamlit.
+
+La interfaz solo encola PDFs y consulta el estado; los workers (worker.py) toman
+los trabajos, extraen el texto, consultan al modelo y guardan el resultado. Como
+todo queda en la base, un rerun o un click no interrumpe ni repite un trabajo.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_PATH = os.getenv('DASSA_QUEUE_PATH', os.path.join('.cache', 'jobs.sqlite3'))
+# Un trabajo que lleva más que esto en 'running' se considera de un worker caído
+JOB_TIMEOUT = 600
+MAX_ATTEMPTS = 3
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    status: str
+    backend: str
+    cache_key: str
+    attempts: int
+    pdf_bytes: Optional[bytes] = None
+    pdf_text: Optional[str] = None
+    reply: Optional[str] = None
+    invoice_dict: Optional[dict] = None
+    error: Optional[str] = None
+
+    @property
+    def done(self):
+        return self.status in ('done', 'error', 'duplicate')
+
+_COLUMNS = "id, name, status, backend, cache_key, attempts"
+
+class JobQueue:
+    def __init__(self, path=DEFAULT_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # La conexión se comparte entre los hilos de las sesiones de Streamlit
+        self._lock = threading.Lock()
+        # autocommit: las transacciones se abren a mano donde hace falta
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                backend TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                pdf BLOB,
+                pdf_text TEXT,
+                reply TEXT,
+                invoice_json TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id)")
+
+    def enqueue(self, name, pdf_bytes, backend, cache_key):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (name, backend, cache_key, pdf, created_at) VALUES (?, ?, ?, ?, ?)",
+                (name, backend, cache_key, pdf_bytes, time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        """Toma el trabajo más viejo en cola (o uno colgado de un worker caído)."""
+        with self._lock:
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'error', error = 'se superó la cantidad de intentos', finished_at = ?, pdf = NULL "
+                    "WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+                    (now, now - JOB_TIMEOUT, MAX_ATTEMPTS),
+                )
+                row = self._conn.execute(
+                    f"SELECT {_COLUMNS}, pdf FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND started_at < ?) ORDER BY id LIMIT 1",
+                    (now - JOB_TIMEOUT,),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker, now, row[0]),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return Job(row[0], row[1], 'running', row[3], row[4], row[5] + 1, pdf_bytes=row[6])
+
+    def complete(self, job_id, pdf_text, reply, invoice_dict=None, error=None):
+        invoice_json = json.dumps(invoice_dict, ensure_ascii=False) if invoice_dict is not None else None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', pdf_text = ?, reply = ?, invoice_json = ?, error = ?, "
+                "finished_at = ?, pdf = NULL WHERE id = ?",
+                (pdf_text, reply, invoice_json, error, time.time(), job_id),
+            )
+
+    def mark_duplicate(self, job_id, error):
+        """La factura ya se había procesado antes (ver invoice_index.py): no se exporta de nuevo."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'duplicate', error = ?, finished_at = ?, pdf = NULL WHERE id = ?",
+                (error, time.time(), job_id),
+            )
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'error', error = ?, finished_at = ?, pdf = NULL WHERE id = ?",
+                (error, time.time(), job_id),
+            )
+
+    def get(self, job_ids):
+        """Estado y resultado de los trabajos pedidos, en el mismo orden."""
+        if not job_ids:
+            return []
+        placeholders = ",".join("?" * len(job_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS}, pdf_text, reply, invoice_json, error FROM jobs WHERE id IN ({placeholders})",
+                list(job_ids),
+            ).fetchall()
+        jobs = {}
+        for row in rows:
+            jobs[row[0]] = Job(*row[:6], pdf_text=row[6], reply=row[7],
+                               invoice_dict=json.loads(row[8]) if row[8] else None, error=row[9])
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def purge(self, older_than=86400):
+        """Borra los trabajos terminados hace más de `older_than` segundos."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'error', 'duplicate') AND finished_at < ?",
+                (time.time() - older_than,),
+            )
@@ -0,0 +1,226 @@
+"""Parser de JSON tolerante para las respuestas del modelo.
+
+Recorre el texto una sola vez y acepta los errores típicos de los modelos:
+bloques ```json, comillas simples, claves sin comillas, comas de más o de menos,
+comentarios y True/False/None de Python. A diferencia de los reemplazos con regex,
+los strings se leen como strings, así que un valor como "Hora: 10:30" no se rompe.
+
+Una respuesta cortada a la mitad no se da por buena: lo que se llegó a leer puede
+parecer una factura completa (un importe '1.331,' o un producto sin precio), así
+que se devuelve como error para que la factura se revise.
+
+    obj, error = parse_json_lenient(texto)   # error es None si se pudo leer
+"""
+import json
+
+_WHITESPACE = ' \t\r\n'
+_ESCAPES = {'"': '"', "'": "'", '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+_NUMBER_CHARS = set('0123456789+-.eE')
+_decoder = json.JSONDecoder()
+
+class JSONRepairError(ValueError):
+    def __init__(self, reason, pos):
+        super().__init__(f"{reason} (posición {pos})")
+        self.reason = reason
+        self.pos = pos
+
+def parse_json_lenient(text, stats=None):
+    """Devuelve (objeto, None) si pudo leer un objeto JSON del texto, o (None, motivo) si no.
+
+    Si se pasa un dict en `stats`, se anota en stats['path'] qué camino se usó
+    ('fast' si el JSON era válido, 'lenient' si hubo que repararlo).
+    """
+    if stats is None:
+        stats = {}
+    stats['path'] = None
+    if not text:
+        return None, "respuesta vacía"
+    start = text.find('{')
+    if start == -1:
+        return None, "no se encontró un objeto JSON en la respuesta"
+    # Camino rápido: si el JSON ya es válido lo lee el decoder de la stdlib (en C)
+    try:
+        stats['path'] = 'fast'
+        return _decoder.raw_decode(text, start)[0], None
+    except json.JSONDecodeError:
+        pass
+    stats['path'] = 'lenient'
+    parser = _Parser(text, start)
+    try:
+        obj = parser.parse()
+    except JSONRepairError as e:
+        return None, str(e)
+    if parser.truncated:
+        return None, f"la respuesta está cortada (termina en la posición {parser.truncated})"
+    return obj, None
+
+class _Parser:
+    def __init__(self, text, pos):
+        self.text = text
+        self.pos = pos
+        self.end = len(text)
+        self.truncated = None  # posición donde se cortó, si quedó algo abierto
+
+    def parse(self):
+        return self._value()
+
+    def _skip(self):
+        text, end = self.text, self.end
+        while self.pos < end:
+            c = text[self.pos]
+            if c in _WHITESPACE:
+                self.pos += 1
+            elif text.startswith('//', self.pos):
+                newline = text.find('\n', self.pos)
+                self.pos = end if newline == -1 else newline + 1
+            elif text.startswith('/*', self.pos):
+                close = text.find('*/', self.pos + 2)
+                self.pos = end if close == -1 else close + 2
+            else:
+                break
+
+    def _value(self):
+        self._skip()
+        if self.pos >= self.end:
+            raise JSONRepairError("la respuesta termina antes de un valor", self.pos)
+        c = self.text[self.pos]
+        if c == '{':
+            return self._object()
+        if c == '[':
+            return self._array()
+        if c in '"\'':
+            return self._string(c)
+        if c in '-0123456789':
+            return self._number()
+        if c in '}],:':
+            raise JSONRepairError(f"se esperaba un valor y se encontró '{c}'", self.pos)
+        return self._bare_word()
+
+    def _object(self):
+        obj = {}
+        self.pos += 1
+        while True:
+            self._skip()
+            if self.pos >= self.end:
+                self.truncated = self.pos
+                return obj
+            c = self.text[self.pos]
+            if c == '}':
+                self.pos += 1
+                return obj
+            if c == ',':
+                self.pos += 1  # coma de más
+                continue
+            if c == '`':
+                return obj  # cierre del bloque ``` sin la llave final
+            key = self._string(c) if c in '"\'' else self._bare_key()
+            self._skip()
+            if self.pos >= self.end:
+                self.truncated = self.pos
+                return obj
+            if self.text[self.pos] != ':':
+                raise JSONRepairError(f"falta ':' después de la clave {key!r}", self.pos)
+            self.pos += 1
+            self._skip()
+            if self.pos >= self.end:
+                self.truncated = self.pos
+                return obj
+            obj[key] = self._value()
+
+    def _array(self):
+        items = []
+        self.pos += 1
+        while True:
+            self._skip()
+            if self.pos >= self.end:
+                self.truncated = self.pos
+                return items
+            c = self.text[self.pos]
+            if c == ']':
+                self.pos += 1
+                return items
+            if c == ',':
+                self.pos += 1
+                continue
+            if c == '}':
+                raise JSONRepairError("se encontró '}' dentro de una lista", self.pos)
+            items.append(self._value())
+
+    def _closes_string(self, i):
+        # Una comilla cierra el string si lo que sigue es fin de valor (o un comentario,
+        # o la clave siguiente en otra línea si falta la coma); si no, es parte del texto
+        j = i + 1
+        newline = False
+        while j < self.end and self.text[j] in _WHITESPACE:
+            newline = newline or self.text[j] == '\n'
+            j += 1
+        return j >= self.end or self.text[j] in ',}]:/' or (newline and self.text[j] in '"\'')
+
+    def _string(self, quote):
+        text, end = self.text, self.end
+        self.pos += 1
+        chunks = []
+        start = self.pos
+        while self.pos < end:
+            c = text[self.pos]
+            if c == '\\' and self.pos + 1 < end:
+                chunks.append(text[start:self.pos])
+                esc = text[self.pos + 1]
+                if esc == 'u' and self.pos + 6 <= end:
+                    try:
+                        chunks.append(chr(int(text[self.pos + 2:self.pos + 6], 16)))
+                        self.pos += 6
+                    except ValueError:
+                        chunks.append(esc)
+                        self.pos += 2
+                else:
+                    chunks.append(_ESCAPES.get(esc, esc))
+                    self.pos += 2
+                start = self.pos
+            elif c == quote and self._closes_string(self.pos):
+                chunks.append(text[start:self.pos])
+                self.pos += 1
+                return ''.join(chunks)
+            else:
+                self.pos += 1
+        chunks.append(text[start:self.pos])
+        self.truncated = self.pos
+        return ''.join(chunks)
+
+    def _bare_key(self):
+        start = self.pos
+        colon = self.text.find(':', start)
+        if colon == -1:
+            raise JSONRepairError("clave sin ':'", start)
+        key = self.text[start:colon].strip()
+        if not key or any(c in key for c in '{}[],"\''):
+            raise JSONRepairError("clave inválida", start)
+        self.pos = colon
+        return key
+
+    def _number(self):
+        start = self.pos
+        while self.pos < self.end and self.text[self.pos] in _NUMBER_CHARS:
+            self.pos += 1
+        raw = self.text[start:self.pos]
+        try:
+            return int(raw)
+        except ValueError:
+            pass
+        try:
+            return float(raw)
+        except ValueError:
+            raise JSONRepairError(f"número inválido: {raw!r}", start) from None
+
+    def _bare_word(self):
+        # Valores sin comillas: true/false/null (también los de Python) o texto suelto
+        start = self.pos
+        while self.pos < self.end and self.text[self.pos] not in ',}]\n':
+            self.pos += 1
+        word = self.text[start:self.pos].strip()
+        if word in _LITERALS:
+            return _LITERALS[word]
+        if word.startswith('`'):
+            raise JSONRepairError("bloque de código sin cerrar", start)
+        return word
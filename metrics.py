@@ -0,0 +1,153 @@
+"""Tiempos por etapa y consumo de tokens del procesamiento de facturas.
+
+Cada medición se agrega como una línea JSON a METRICS_PATH, así lo que miden los
+workers (que corren en otros procesos) queda visible para el panel de la app.
+
+    with metrics.invoice_context(job.id):
+        with metrics.span('pdf_extract'):
+            ...
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+METRICS_PATH = os.getenv('DASSA_METRICS_PATH', os.path.join('.cache', 'metrics.jsonl'))
+# Al superar este tamaño el log se rota a METRICS_PATH + '.1'
+MAX_BYTES = 50 * 1024 * 1024
+STAGES = ('pdf_extract', 'ocr', 'llm_request', 'json_parse', 'dataframe_build', 'chat_ttft', 'chat_total', 'faq_lookup',
+          'rate_limit_wait')
+# USD por millón de tokens (entrada, salida)
+PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+}
+
+_invoice = contextvars.ContextVar('invoice', default=None)
+_lock = threading.Lock()
+
+def record(event, path=None):
+    path = path or METRICS_PATH
+    event = {'ts': time.time(), 'invoice': _invoice.get(), **event}
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    with _lock:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            if os.path.getsize(path) > MAX_BYTES:
+                os.replace(path, path + '.1')
+        except OSError:
+            pass
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+@contextmanager
+def invoice_context(invoice_id):
+    """Asocia las mediciones hechas dentro del bloque a una factura."""
+    token = _invoice.set(invoice_id)
+    try:
+        yield
+    finally:
+        _invoice.reset(token)
+
+@contextmanager
+def span(stage, **labels):
+    """Mide la duración del bloque; se pueden agregar etiquetas al dict que devuelve."""
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield labels
+        ok = True
+    finally:
+        record({'type': 'span', 'stage': stage, 'seconds': time.perf_counter() - start, 'ok': ok, **labels})
+
+def cost_usd(model, prompt_tokens, completion_tokens):
+    # Los modelos con fecha (gpt-4o-mini-2024-07-18) usan el precio del modelo base
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            price_in, price_out = PRICES[name]
+            return (prompt_tokens * price_in + completion_tokens * price_out) / 1e6
+    return None
+
+def record_usage(model, prompt_tokens, completion_tokens):
+    record({
+        'type': 'usage', 'model': model,
+        'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+        'cost_usd': cost_usd(model or '', prompt_tokens, completion_tokens),
+    })
+
+def load(path=None, limit=50000):
+    """Últimas `limit` mediciones del log."""
+    path = path or METRICS_PATH
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()[-limit:]
+    except FileNotFoundError:
+        return []
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue  # línea a medio escribir
+    return records
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def summarize(records):
+    """Devuelve (tiempos por etapa, consumo por modelo)."""
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    usage = defaultdict(lambda: {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0})
+    for rec in records:
+        if rec.get('type') == 'span':
+            durations[rec['stage']].append(rec['seconds'])
+            if not rec.get('ok', True):
+                errors[rec['stage']] += 1
+        elif rec.get('type') == 'usage':
+            model = usage[rec.get('model') or '?']
+            model['requests'] += 1
+            model['prompt_tokens'] += rec.get('prompt_tokens') or 0
+            model['completion_tokens'] += rec.get('completion_tokens') or 0
+            model['cost_usd'] += rec.get('cost_usd') or 0.0
+    stages = {
+        stage: {
+            'count': len(values),
+            'errors': errors[stage],
+            'p50': _percentile(values, 50),
+            'p95': _percentile(values, 95),
+        }
+        for stage, values in durations.items()
+    }
+    return stages, dict(usage)
+
+def prometheus_text(records):
+    """Las mismas métricas en formato de texto de Prometheus."""
+    stages, usage = summarize(records)
+    lines = [
+        "# HELP dassa_stage_seconds Duración de cada etapa del procesamiento de facturas.",
+        "# TYPE dassa_stage_seconds summary",
+    ]
+    for stage, s in sorted(stages.items()):
+        lines.append(f'dassa_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50"]:.6f}')
+        lines.append(f'dassa_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95"]:.6f}')
+        lines.append(f'dassa_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+    lines += [
+        "# HELP dassa_tokens_total Tokens consumidos por modelo.",
+        "# TYPE dassa_tokens_total counter",
+    ]
+    for model, u in sorted(usage.items()):
+        lines.append(f'dassa_tokens_total{{model="{model}",kind="prompt"}} {u["prompt_tokens"]}')
+        lines.append(f'dassa_tokens_total{{model="{model}",kind="completion"}} {u["completion_tokens"]}')
+    lines += [
+        "# HELP dassa_cost_usd_total Costo estimado en USD por modelo.",
+        "# TYPE dassa_cost_usd_total counter",
+    ]
+    for model, u in sorted(usage.items()):
+        lines.append(f'dassa_cost_usd_total{{model="{model}"}} {u["cost_usd"]:.6f}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,119 @@
+"""OCR local para facturas escaneadas.
+
+Si PyPDF2 no encuentra texto en una página (es una imagen), la página se rasteriza con
+pypdfium2 y se lee con Tesseract. Solo se usa para las primeras páginas y para la
+zona de totales de la última; el resultado queda guardado por hash de página, así
+volver a subir el mismo escaneo no repite el OCR.
+
+Es opcional: hace falta `pip install pypdfium2 pytesseract` y el binario `tesseract`
+con el idioma español (paquete tesseract-ocr-spa).
+"""
+import hashlib
+import importlib.util
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+OCR_LANG = os.getenv('DASSA_OCR_LANG', 'spa')
+OCR_DPI = 200
+# Tesseract corre en su propio proceso, así que alcanzan hilos para leer varias páginas a la vez
+OCR_WORKERS = 4
+# Parte inferior de la página donde suelen estar el neto, el IVA y el total
+TOTALS_REGION = 0.4
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', 'tesseract')
+CACHE_PATH = os.getenv('DASSA_OCR_CACHE_PATH', os.path.join('.cache', 'ocr_cache.sqlite3'))
+
+_conn = None
+
+def available():
+    # Se busca sin importar: pytesseract carga pandas si está instalado, y eso no hace
+    # falta pagarlo al arrancar la app ni con los PDFs que tienen texto
+    return (importlib.util.find_spec('pypdfium2') is not None
+            and importlib.util.find_spec('pytesseract') is not None
+            and shutil.which(TESSERACT_CMD) is not None)
+
+def page_hash(page):
+    """Hash de una página de PyPDF2: su contenido más las imágenes que dibuja."""
+    h = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        h.update(contents.get_data())
+    xobjects = _xobjects(page.get('/Resources'))
+    for name in sorted(xobjects):
+        h.update(name.encode('utf-8'))
+        h.update(xobjects[name].get_object().get_data())
+    return h.hexdigest()
+
+def _xobjects(resources):
+    resources = resources.get_object() if resources is not None else None
+    xobjects = resources.get('/XObject') if resources is not None else None
+    return xobjects.get_object() if xobjects is not None else {}
+
+def has_image(page, _depth=0):
+    """True si la página dibuja alguna imagen (directamente o dentro de un formulario)."""
+    for xobject in _xobjects(page.get('/Resources')).values():
+        xobject = xobject.get_object()
+        subtype = xobject.get('/Subtype')
+        if subtype == '/Image':
+            return True
+        # Los escaneos a veces vienen envueltos en un XObject de formulario
+        if subtype == '/Form' and _depth < 3 and has_image(xobject, _depth + 1):
+            return True
+    return False
+
+def _cache():
+    # Una conexión por proceso (esto corre dentro de los workers)
+    global _conn
+    if _conn is None:
+        if os.path.dirname(CACHE_PATH):
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        _conn = sqlite3.connect(CACHE_PATH, timeout=30, check_same_thread=False)
+        _conn.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        _conn.commit()
+    return _conn
+
+def _render(document, number, region):
+    page = document[number - 1]
+    crop = (0, 0, 0, 0)
+    if region == 'totals':
+        crop = (0, 0, 0, page.get_height() * (1 - TOTALS_REGION))
+    return page.render(scale=OCR_DPI / 72, crop=crop, grayscale=True).to_pil()
+
+def ocr_pages(pdf_file, pages):
+    """Lee con OCR las páginas pedidas como [(número, hash de la página, región)].
+
+    La región es None para la página entera o 'totals' para la franja inferior.
+    Devuelve {número: texto}.
+    """
+    results = {}
+    todo = []
+    conn = _cache()
+    for number, digest, region in pages:
+        key = f"{digest}:{region or 'page'}:{OCR_LANG}:{OCR_DPI}"
+        row = conn.execute("SELECT text FROM pages WHERE key = ?", (key,)).fetchone()
+        if row:
+            results[number] = row[0]
+        else:
+            todo.append((number, key, region))
+    if not todo:
+        return results
+
+    import pypdfium2 as pdfium
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    if hasattr(pdf_file, 'seek'):
+        pdf_file.seek(0)
+    document = pdfium.PdfDocument(pdf_file)
+    try:
+        # pdfium no se puede usar desde varios hilos: se rasteriza acá y solo el OCR va en paralelo
+        images = [_render(document, number, region) for number, _, region in todo]
+    finally:
+        document.close()
+    with ThreadPoolExecutor(max_workers=OCR_WORKERS) as pool:
+        texts = list(pool.map(lambda image: pytesseract.image_to_string(image, lang=OCR_LANG), images))
+    for (number, key, _), text in zip(todo, texts):
+        results[number] = text
+        conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (key, text))
+    conn.commit()
+    return results
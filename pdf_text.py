@@ -0,0 +1,115 @@
+import io
+import re
+import time
+
+import metrics
+import ocr
+
+# Con el encabezado (CUIT) y el bloque de totales ya leídos, el resto suelen ser
+# copias (DUPLICADO/TRIPLICADO) o anexos que no hace falta mandar al modelo
+HEADER_RE = re.compile(r'CUIT', re.IGNORECASE)
+TOTALS_RE = re.compile(r'Importe Total|\bTOTAL\b\s*:?\s*\$', re.IGNORECASE)
+COPY_RE = re.compile(r'^\s*(?:ORIGINAL|DUPLICADO|TRIPLICADO|CUADRUPLICADO)\b', re.IGNORECASE | re.MULTILINE)
+
+# Tope de caracteres de la factura por prompt; las más largas se mandan en varias partes
+MAX_PROMPT_CHARS = 15000
+# Líneas que se conservan desde el importe total (CAE, vencimiento del CAE)
+TOTALS_TAIL_LINES = 4
+# Las páginas que PyPDF2 tarda más que esto en leer se anotan en las métricas
+SLOW_PAGE_SECONDS = 1.0
+# Con menos caracteres que esto (y alguna imagen) la página se considera escaneada
+MIN_PAGE_CHARS = 20
+# Páginas escaneadas que se leen enteras con OCR (de la última solo se lee la zona de totales)
+OCR_MAX_PAGES = 2
+
+class ScannedPDFError(ValueError):
+    pass
+
+def iter_pages(pdf_file):
+    """Genera (número de página, texto, segundos que tardó PyPDF2) página por página."""
+    import PyPDF2
+    reader = pdf_file if isinstance(pdf_file, PyPDF2.PdfReader) else PyPDF2.PdfReader(pdf_file)
+    for number, page in enumerate(reader.pages, start=1):
+        start = time.perf_counter()
+        text = page.extract_text() or ""
+        yield number, text, time.perf_counter() - start
+
+def extract_text_from_pdf(pdf_file, stop_early=True, max_pages=None, use_ocr=True):
+    """Extrae el texto del PDF, cortando cuando ya aparecieron el encabezado y los totales.
+
+    Las páginas sin texto (escaneos) se leen con OCR si está instalado (ver ocr.py); si
+    el PDF queda sin texto se lanza ScannedPDFError en lugar de mandar un prompt vacío.
+    """
+    import PyPDF2  # solo lo usan los workers; la app y el chat no lo necesitan
+    reader = PyPDF2.PdfReader(pdf_file)
+    pages = []
+    scanned = []
+    seen_header = seen_totals = False
+    for number, text, seconds in iter_pages(reader):
+        pages.append(text)
+        # Una página casi vacía sin imágenes (un anexo en blanco) no tiene nada que leer con OCR
+        if len(text.strip()) < MIN_PAGE_CHARS and ocr.has_image(reader.pages[number - 1]):
+            scanned.append(number)
+        if seconds > SLOW_PAGE_SECONDS:
+            metrics.record({'type': 'slow_page', 'page': number, 'seconds': seconds})
+        if max_pages and number >= max_pages:
+            break
+        if stop_early:
+            seen_header = seen_header or bool(HEADER_RE.search(text))
+            seen_totals = seen_totals or bool(TOTALS_RE.search(text))
+            if seen_header and seen_totals:
+                break
+    if scanned and use_ocr:
+        _ocr_scanned_pages(pdf_file, reader, pages, scanned)
+    text = "\n".join(pages)
+    if not text.strip():
+        reason = "el OCR no encontró texto" if use_ocr and ocr.available() else "no hay OCR instalado"
+        raise ScannedPDFError(f"El PDF no tiene texto (¿es un escaneo?) y {reason}")
+    return text
+
+def _ocr_scanned_pages(pdf_file, reader, pages, scanned):
+    if not ocr.available():
+        return
+    requests = [(number, ocr.page_hash(reader.pages[number - 1]), None) for number in scanned[:OCR_MAX_PAGES]]
+    # Si los totales no están en las páginas con texto, probablemente estén al pie de la última
+    last = len(pages)
+    if last in scanned[OCR_MAX_PAGES:] and not any(TOTALS_RE.search(text) for text in pages):
+        requests.append((last, ocr.page_hash(reader.pages[last - 1]), 'totals'))
+    with metrics.span('ocr', pages=len(requests)):
+        texts = ocr.ocr_pages(pdf_file, requests)
+    for number, text in texts.items():
+        pages[number - 1] = text
+
+def extract_text_from_bytes(pdf_bytes):
+    """Igual que extract_text_from_pdf pero recibe bytes, para poder usarla en un pool de procesos."""
+    return extract_text_from_pdf(io.BytesIO(pdf_bytes))
+
+def prompt_parts(text, max_chars=MAX_PROMPT_CHARS):
+    """Divide el texto de la factura en partes de hasta `max_chars` para el prompt.
+
+    Solo se descarta lo que viene después del bloque de totales (copias DUPLICADO,
+    anexos). Si los renglones igual no entran, el texto se parte por líneas: el
+    encabezado queda en la primera parte y los totales en la última.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    totals = TOTALS_RE.search(text)
+    if totals:
+        # Después del importe total suelen venir el CAE y su vencimiento; la copia siguiente no
+        tail = text[totals.start():].split('\n')[:TOTALS_TAIL_LINES + 1]
+        end = totals.start() + len('\n'.join(tail))
+        copy = COPY_RE.search(text, totals.end(), end)
+        text = text[:copy.start() if copy else end].rstrip()
+    if len(text) <= max_chars:
+        return [text]
+    parts, current, size = [], [], 0
+    for line in text.split('\n'):
+        for start in range(0, max(len(line), 1), max_chars):
+            piece = line[start:start + max_chars]
+            if current and size + len(piece) + 1 > max_chars:
+                parts.append('\n'.join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    parts.append('\n'.join(current))
+    return parts
@@ -0,0 +1,141 @@
+"""Almacenamiento compacto de las facturas procesadas en una sesión.
+
+En lugar de una lista de dicts que repite el encabezado de la factura en cada
+producto, se guardan dos tablas por columnas: una de facturas (encabezado) y otra
+de renglones que apunta a su factura. Importes y fechas se convierten una sola vez
+desde el formato argentino y quedan en arrays tipados; el DataFrame con el join
+se arma solo cuando hace falta mostrar algo.
+"""
+import re
+from array import array
+from datetime import date, datetime
+
+HEADER_COLUMNS = ['Fecha', 'Número de Factura', 'CUIT Emisor', 'Cliente', 'Importe Total Factura', 'IVA']
+LINE_COLUMNS = ['Descripción', 'Cantidad', 'Precio Unitario', 'Subtotal']
+_LINE_NUMERIC = ('Cantidad', 'Precio Unitario', 'Subtotal')
+_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y')
+_EPOCH = date(1970, 1, 1).toordinal()
+_NAN = float('nan')
+
+def parse_ar_number(value):
+    """Convierte importes como '$ 1.331,00', '1331,5' o 1331 a float (NaN si no se puede)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return _NAN
+    text = re.sub(r'[^\d,.\-]', '', str(value))
+    if ',' in text and '.' in text:
+        # El último separador es el decimal
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif ',' in text:
+        text = text.replace(',', '.') if text.count(',') == 1 else text.replace(',', '')
+    elif text.count('.') > 1 or re.search(r'\.\d{3}$', text):
+        text = text.replace('.', '')
+    try:
+        return float(text)
+    except ValueError:
+        return _NAN
+
+def parse_ar_date(value):
+    """Devuelve el ordinal de la fecha (0 si no se reconoce el formato)."""
+    value = str(value or '').strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).toordinal()
+        except ValueError:
+            continue
+    return 0
+
+class ProductStore:
+    def __init__(self):
+        # Tabla de facturas
+        self._dates = array('i')
+        self._numbers = []
+        self._cuits = []
+        self._clients = []
+        self._totals = array('d')
+        self._ivas = array('d')
+        # Tabla de renglones
+        self._line_invoice = array('i')
+        self._descriptions = []
+        self._line_values = {col: array('d') for col in _LINE_NUMERIC}
+        # Claves fuera del esquema, solo para los renglones que las tienen
+        self._extras = {}
+
+    @property
+    def invoice_count(self):
+        return len(self._numbers)
+
+    def __len__(self):
+        return len(self._line_invoice)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def add_invoice(self, invoice_dict):
+        """Agrega la factura y sus renglones; devuelve el id de la factura."""
+        invoice_id = len(self._numbers)
+        self._dates.append(parse_ar_date(invoice_dict.get('Fecha')))
+        self._numbers.append(str(invoice_dict.get('Número de Factura', '')))
+        self._cuits.append(re.sub(r'\D', '', str(invoice_dict.get('CUIT Emisor', ''))))
+        self._clients.append(str(invoice_dict.get('Cliente', '')))
+        self._totals.append(parse_ar_number(invoice_dict.get('Importe Total')))
+        self._ivas.append(parse_ar_number(invoice_dict.get('IVA')))
+
+        products = invoice_dict.get('Detalle de Productos')
+        # Igual que invoice_to_products: los renglones que no son objetos no cuentan, y
+        # sin ninguno queda una fila con la información general
+        products = [p for p in products if isinstance(p, dict)] if isinstance(products, list) else []
+        if not products:
+            products = [{'Descripción': 'Información general', 'Subtotal': invoice_dict.get('Importe Total', '')}]
+        for product in products:
+            self._line_invoice.append(invoice_id)
+            self._descriptions.append(str(product.get('Descripción', '')))
+            for col in _LINE_NUMERIC:
+                self._line_values[col].append(parse_ar_number(product.get(col)))
+            extra = {k: v for k, v in product.items() if k not in LINE_COLUMNS}
+            if extra:
+                self._extras[len(self._line_invoice) - 1] = extra
+        return invoice_id
+
+    def to_frame(self, since_invoice=0, last=None):
+        """DataFrame de productos con el encabezado de su factura (join hecho recién acá)."""
+        import numpy as np
+        import pandas as pd
+
+        line_invoice = np.frombuffer(self._line_invoice, dtype=np.int32) if self._line_invoice else np.array([], dtype=np.int32)
+        rows = np.nonzero(line_invoice >= since_invoice)[0]
+        if last is not None:
+            rows = rows[-last:]
+        ids = line_invoice[rows]
+
+        dates = np.frombuffer(self._dates, dtype=np.int32) if self._dates else np.array([], dtype=np.int32)
+        day_numbers = dates[ids].astype('int64') - _EPOCH
+        fechas = np.where(dates[ids] > 0, day_numbers, np.iinfo('int64').min).astype('datetime64[D]')
+
+        def pick(values):
+            return [values[i] for i in ids]
+
+        def pick_numeric(values):
+            return np.frombuffer(values, dtype=np.float64)[ids] if len(values) else np.array([], dtype=np.float64)
+
+        columns = {
+            'Fecha': fechas,
+            'Número de Factura': pick(self._numbers),
+            'CUIT Emisor': pick(self._cuits),
+            'Cliente': pick(self._clients),
+            'Importe Total Factura': pick_numeric(self._totals),
+            'IVA': pick_numeric(self._ivas),
+            'Descripción': [self._descriptions[i] for i in rows],
+        }
+        for col in _LINE_NUMERIC:
+            values = self._line_values[col]
+            columns[col] = np.frombuffer(values, dtype=np.float64)[rows] if len(values) else np.array([], dtype=np.float64)
+        df = pd.DataFrame(columns)
+        extras = [self._extras.get(i) for i in rows]
+        if any(extras):
+            df = df.join(pd.DataFrame([extra or {} for extra in extras], index=df.index), rsuffix=' (producto)')
+        return df
@@ -0,0 +1,346 @@
+"""Ritmo de las llamadas a OpenAI: límite de requests, reintentos, plazos y requests duplicados.
+
+Todas las llamadas de un proceso (facturas, chat, resúmenes) pasan por el mismo Scheduler:
+
+- Dos token buckets, de requests y de tokens por minuto. Cada request HTTP del cliente
+  espera su turno antes de salir (hook de httpx, ver make_client), y los encabezados
+  x-ratelimit-* de cada respuesta ajustan los buckets a lo que informa la API. Como el
+  límite es de la cuenta, así cada worker (corren en otros procesos) ve también el
+  consumo de los demás. Un 429 frena a todo el proceso hasta el Retry-After.
+- Reintentos con backoff exponencial y jitter ante 429, errores 5xx, timeouts y cortes.
+  Un 429 por falta de saldo no se reintenta.
+- Un plazo por pedido: cada intento usa como timeout lo que queda y ni las esperas ni
+  los reintentos lo pasan. Un stream que deja de mandar datos se corta a los
+  STREAM_IDLE_TIMEOUT segundos en lugar de colgar la página.
+- Requests duplicados (hedging), opcional con DASSA_HEDGE=1: si una llamada tarda más
+  que el p95 de las anteriores se manda otra igual y se usa la que llegue primero.
+  Duplica el costo de esas llamadas, por eso está apagado por defecto.
+"""
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import metrics
+
+# Límites de la cuenta; se corrigen solos con los encabezados de la API
+REQUESTS_PER_MINUTE = int(os.getenv('DASSA_RPM', '500'))
+TOKENS_PER_MINUTE = int(os.getenv('DASSA_TPM', '200000'))
+# La API aplica el límite por minuto en ventanas cortas (60.000 rpm son ~1.000 por
+# segundo): las ráfagas se limitan a lo que entra en este tiempo
+BURST_SECONDS = 1
+MAX_RETRIES = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 30
+# Segundos sin recibir nada de un stream para darlo por colgado
+STREAM_IDLE_TIMEOUT = 30
+HEDGE = os.getenv('DASSA_HEDGE') == '1'
+HEDGE_QUANTILE = 0.95
+# Latencias que hacen falta antes de duplicar requests, y demora mínima
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 1.0
+# Fracción máxima de llamadas duplicadas: si todo se pone lento, duplicar solo empeora la cola
+HEDGE_BUDGET = 0.1
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class RetryableError(Exception):
+    """Error transitorio que no llega como excepción del SDK (por ejemplo, un run que falló por el límite)."""
+
+def parse_duration(value):
+    """'1s', '6m0s', '20ms' -> segundos."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _UNITS[unit] for amount, unit in parts)
+
+def retry_after(headers):
+    for name, scale in (('retry-after-ms', 0.001), ('retry-after', 1)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+def _is_transport_error(error):
+    # El SDK no envuelve los cortes de los streams de asistentes: llegan las excepciones
+    # de httpx tal cual. Se reconocen por nombre para no depender de la versión de httpx
+    return any(cls.__name__ == 'TransportError' for cls in type(error).__mro__)
+
+def is_timeout(error):
+    from openai import APITimeoutError
+    return (isinstance(error, (TimeoutError, APITimeoutError))
+            or any(cls.__name__ == 'TimeoutException' for cls in type(error).__mro__))
+
+def is_retryable(error):
+    if isinstance(error, RetryableError) or _is_transport_error(error):
+        return True
+    if isinstance(error, DeadlineExceeded):
+        return False
+    from openai import APIConnectionError, APIStatusError  # incluye APITimeoutError
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        if error.response.headers.get('x-should-retry') == 'false':
+            return False
+        if error.status_code == 429:
+            return getattr(error, 'code', None) != 'insufficient_quota'
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+class TokenBucket:
+    """`per_minute` unidades por minuto, con ráfagas de hasta BURST_SECONDS de consumo.
+
+    Quien pide más de lo que hay reserva igual (el nivel queda negativo) y espera lo
+    que tarda en reponerse, así los pedidos salen en el orden en que llegaron.
+    """
+    def __init__(self, per_minute):
+        self._lock = threading.Lock()
+        self.per_minute = per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    @property
+    def rate(self):
+        return self.per_minute / 60
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate * BURST_SECONDS)
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1, deadline=None):
+        """Reserva `amount` y espera hasta poder usarlo; devuelve los segundos esperados."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            delay = max(self._paused_until - now, (amount - self.level) / self.rate, 0)
+            if deadline is not None and now + delay > deadline:
+                raise DeadlineExceeded(f"No hay cupo de la API antes del plazo (faltan {delay:.1f} s)")
+            self.level -= amount
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def available(self, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return now >= self._paused_until and self.level >= amount
+
+    def update(self, limit, remaining):
+        """Ajusta el bucket con lo que informa la API (x-ratelimit-limit-* / remaining-*)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                self.per_minute = limit
+            if remaining is not None:
+                self.level = min(self.level, remaining)
+
+    def pause(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            self.level = min(self.level, 0)
+
+class Scheduler:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, hedge=HEDGE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self._latencies = defaultdict(lambda: deque(maxlen=200))
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    # Hooks del cliente HTTP
+
+    def on_request(self, request):
+        # Estimación gruesa de tokens: ~4 bytes por token del body
+        try:
+            cost = len(request.content) // 4
+        except Exception:
+            cost = 0
+        deadline = _deadline.get()
+        waited = self.requests.acquire(1, deadline)
+        if cost:
+            waited += self.tokens.acquire(cost, deadline)
+        if waited:
+            self._bump('throttled')
+            metrics.record({'type': 'span', 'stage': 'rate_limit_wait', 'seconds': waited, 'ok': True})
+
+    def on_response(self, response):
+        headers = response.headers
+        for bucket, kind in ((self.requests, 'requests'), (self.tokens, 'tokens')):
+            limit = _int(headers.get(f'x-ratelimit-limit-{kind}'))
+            remaining = _int(headers.get(f'x-ratelimit-remaining-{kind}'))
+            if limit or remaining is not None:
+                bucket.update(limit, remaining)
+        if response.status_code == 429:
+            self._bump('rate_limited')
+            delay = retry_after(headers)
+            if delay is None:
+                # Sin Retry-After: hasta que se reponga lo que se agotó
+                exhausted = 'tokens' if headers.get('x-ratelimit-remaining-tokens') == '0' else 'requests'
+                delay = parse_duration(headers.get(f'x-ratelimit-reset-{exhausted}')) or BASE_DELAY
+            self.requests.pause(delay)
+
+    # Reintentos, plazos y hedging
+
+    @contextmanager
+    def deadline(self, deadline):
+        """Aplica `deadline` (time.monotonic) a las esperas de los requests hechos dentro del bloque."""
+        token = _deadline.set(deadline)
+        try:
+            yield
+        finally:
+            _deadline.reset(token)
+
+    def retry_delay(self, error, attempt, deadline):
+        """Segundos a esperar antes del intento `attempt` + 1, o None si no hay que reintentar."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        # Full jitter: los que fallaron juntos no vuelven todos al mismo tiempo
+        delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def note_retry(self, name, error, attempt, delay):
+        self._bump('retries')
+        metrics.record({'type': 'retry', 'name': name, 'error': type(error).__name__,
+                        'attempt': attempt + 1, 'delay': delay})
+
+    def call(self, fn, deadline, name='request', hedge=False):
+        """Llama a `fn(timeout)` reintentando hasta `deadline` (time.monotonic).
+
+        `timeout` es lo que queda del plazo. Con `hedge`, `fn` tiene que poder repetirse
+        sin efectos (no crear threads, por ejemplo).
+        """
+        with self.deadline(deadline):
+            attempt = 0
+            while True:
+                start = time.monotonic()
+                try:
+                    if hedge and self.hedge:
+                        result = self._hedged(fn, deadline, name)
+                    else:
+                        result = fn(_remaining(deadline))
+                except Exception as e:
+                    delay = self.retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    self.note_retry(name, e, attempt, delay)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                with self._lock:
+                    self._counts['calls'] += 1
+                    self._latencies[name].append(time.monotonic() - start)
+                return result
+
+    def hedge_delay(self, name):
+        with self._lock:
+            latencies = sorted(self._latencies[name])
+            if len(latencies) < HEDGE_MIN_SAMPLES or self._counts['hedged'] >= HEDGE_BUDGET * self._counts['calls']:
+                return None
+        return max(HEDGE_MIN_DELAY, latencies[int(HEDGE_QUANTILE * (len(latencies) - 1))])
+
+    def _hedged(self, fn, deadline, name):
+        delay = self.hedge_delay(name)
+        if delay is None:
+            return fn(_remaining(deadline))
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+        # Cada hilo con su copia del contexto, para que vea el plazo
+        first = self._pool.submit(contextvars.copy_context().run, fn, _remaining(deadline))
+        done, _ = wait([first], timeout=delay)
+        # Si no hay cupo, el duplicado solo esperaría en la fila detrás del original
+        if done or not self.requests.available():
+            return first.result()
+        self._bump('hedged')
+        second = self._pool.submit(contextvars.copy_context().run, fn, _remaining(deadline))
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"{name}: sin respuesta antes del plazo")
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                # La otra sigue hasta terminar sola; su resultado se descarta
+                if future is second:
+                    self._bump('hedge_wins')
+                return result
+        raise error
+
+    def _bump(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {name: self._counts[name]
+                    for name in ('calls', 'retries', 'rate_limited', 'throttled', 'hedged', 'hedge_wins')}
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _remaining(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Se agotó el tiempo para responder")
+    return remaining
+
+def get_scheduler():
+    """El Scheduler del proceso (lo comparten todos los clientes y los hilos)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+def event_hooks():
+    """Hooks para el cliente httpx de OpenAI; usan el Scheduler vigente en cada request."""
+    return {
+        'request': [lambda request: get_scheduler().on_request(request)],
+        'response': [lambda response: get_scheduler().on_response(response)],
+    }
@@ -0,0 +1,103 @@
+"""Workers que procesan la cola de facturas (job_queue.py).
+
+    python worker.py --workers 4
+
+La app levanta sus propios workers salvo que DASSA_EXTERNAL_WORKERS esté definida;
+en ese caso hay que correr este script aparte (se pueden correr varios).
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+
+import metrics
+from assistant_backend import check_items, make_client, process_invoice
+from invoice_cache import InvoiceCache
+from invoice_index import DuplicateInvoiceError, InvoiceIndex
+from job_queue import DEFAULT_PATH, JobQueue
+from json_repair import parse_json_lenient
+from pdf_text import extract_text_from_bytes
+
+POLL_INTERVAL = 0.5
+PURGE_INTERVAL = 3600
+
+def get_openai_key():
+    try:
+        from tokens import openai_key
+    except ImportError:
+        openai_key = os.getenv('OPENAI_API_KEY')
+    return openai_key
+
+def run_job(client, cache, index, job):
+    """Procesa un trabajo y devuelve (pdf_text, reply, invoice_dict, error).
+
+    El error es el del parseo si no hay invoice_dict, o un aviso si los renglones no
+    suman el neto de la factura.
+
+    Si la factura ya se había procesado lanza DuplicateInvoiceError, antes de llamar al
+    modelo si se la reconoce por el texto.
+    """
+    ref = f"job:{job.id}"
+    with metrics.invoice_context(job.id):
+        with metrics.span('pdf_extract'):
+            pdf_text = extract_text_from_bytes(job.pdf_bytes)
+        original = index.find_text(pdf_text, exclude_ref=ref)
+        if original:
+            raise DuplicateInvoiceError(original)
+        reply = process_invoice(client, pdf_text, job.backend)
+        with metrics.span('json_parse') as labels:
+            invoice_dict, error = parse_json_lenient(reply, labels)
+    if invoice_dict:
+        # Se exporta igual, pero con el aviso de que pueden faltar renglones
+        error = check_items(invoice_dict, pdf_text)
+        cache.put(job.cache_key, pdf_text, invoice_dict)
+        index.check(invoice_dict, pdf_text, job.name, ref)
+    return pdf_text, reply, invoice_dict, error
+
+def run_worker(queue_path=DEFAULT_PATH, poll_interval=POLL_INTERVAL):
+    queue = JobQueue(queue_path)
+    cache = InvoiceCache()
+    index = InvoiceIndex()
+    client = make_client(get_openai_key())
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    last_purge = 0
+    while True:
+        if time.time() - last_purge > PURGE_INTERVAL:
+            queue.purge()
+            last_purge = time.time()
+        job = queue.claim(name)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        try:
+            queue.complete(job.id, *run_job(client, cache, index, job))
+        except DuplicateInvoiceError as e:
+            queue.mark_duplicate(job.id, str(e))
+        except Exception as e:
+            queue.fail(job.id, f"{type(e).__name__}: {e}")
+
+def start_workers(count, queue_path=DEFAULT_PATH):
+    """Levanta `count` procesos worker en segundo plano (terminan junto con el proceso padre)."""
+    ctx = multiprocessing.get_context("spawn")
+    processes = []
+    for _ in range(count):
+        process = ctx.Process(target=run_worker, args=(queue_path,), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+def main():
+    parser = argparse.ArgumentParser(description="Procesa la cola de facturas de DASSA Bot")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--queue', default=DEFAULT_PATH)
+    args = parser.parse_args()
+    processes = start_workers(args.workers, args.queue)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()